@@ -1,23 +1,232 @@
 import sys
-import pygame
 import SudokuPuzzles
 import copy
-from playsound import playsound
+import array
+import collections
+import itertools
+
+# pygame is imported by run(), so solving without a display (see SudokuBatch.py) neither needs
+# nor loads it.
+pygame = None
+
+try:
+    # for playing note.wav file
+    from playsound import playsound
+except ImportError:
+    playsound = None
 
 # Everytime a value is added we re calc for each cell the avail values.
-# Each cell stores its avail values in an array that is indexed by the solved_step.
-# i.e. cell.avail_values[0] holds a set of the avail values for this cell after
-# solved step 0 (load_puzzle).
-# cell.avail_values[1] holds a set of the avail values for this cell after solved_step 1
-# That allows to go backward ("undo") to the exact setting's of the previous step.
+# Each cell holds its current avail values as a bitmask: bit v is set when value v (1-9)
+# is available, so ALL_VALUES is 0b1111111110.
+# Every change of a cell's avail values is written to the grid's trail as (cell, previous avail values),
+# and every solved step records where the trail stood when the step started.
+# That allows to go backward ("undo") to the exact setting's of the previous step by replaying
+# only the changes made on that step.
 
 # Todo:
 # 1. Sounds.
-# 2. For each puzzle loaded, calculate difficulty 0-100.
-# 3. Store each puzzle in DB and try to find similarities.
-
-# for playing note.wav file
-from pygame.locals import KEYDOWN
+# 2. For each puzzle loaded, calculate difficulty 0-100. Rated without a display by SudokuRating.py, not shown yet.
+# 3. Store each puzzle in DB and try to find similarities. Stored by SudokuDB.py, with isomorphic puzzles found by
+#    their canonical form (SudokuSymmetry.py), not done on load yet.
+
+
+ALL_VALUES = 0b1111111110
+# Lookup tables indexed by a bitmask: the sorted values it holds, and how many there are.
+MASK_VALUES = tuple(tuple(value for value in range(1, 10) if mask & (1 << value)) for mask in range(1 << 10))
+MASK_SIZE = tuple(len(values) for values in MASK_VALUES)
+
+
+# Board topology, built once and shared by all boards. Cells are indexed 0..80 (row * 9 + col).
+ROW_UNITS = tuple(tuple(row * 9 + col for col in range(9)) for row in range(9))
+COL_UNITS = tuple(tuple(row * 9 + col for row in range(9)) for col in range(9))
+SQUARE_UNITS = tuple(tuple((min_row + row) * 9 + min_col + col for row in range(3) for col in range(3))
+                     for min_row in range(0, 9, 3) for min_col in range(0, 9, 3))
+UNITS = ROW_UNITS + COL_UNITS + SQUARE_UNITS
+CELL_SQUARE = tuple(index // 27 * 3 + index % 9 // 3 for index in range(81))
+CELL_UNITS = tuple((ROW_UNITS[index // 9], COL_UNITS[index % 9], SQUARE_UNITS[CELL_SQUARE[index]])
+                   for index in range(81))
+PEERS = tuple(tuple(sorted(set(CELL_UNITS[index][0] + CELL_UNITS[index][1] + CELL_UNITS[index][2]) - {index}))
+              for index in range(81))
+# Unit ids are the positions of the units in UNITS: rows 0..8, cols 9..17, squares 18..26.
+# A (unit id, value) pair is keyed as unit id * 10 + value. The keys of the units of each cell, for value 0:
+CELL_UNIT_KEYS = tuple((index // 9 * 10, (9 + index % 9) * 10, (18 + CELL_SQUARE[index]) * 10) for index in range(81))
+FIRST_UNIT_KEY = {ROW_UNITS: 0, COL_UNITS: 90, SQUARE_UNITS: 180}
+# In the unit values index a cell with an avail value adds to its units: 1 to the count (from bit 10 on) and
+# its index to the sum of indexes (bits 0..9, as 9 indexes sum up to less than 1 << 10).
+INDEX_COUNT = 1 << 10
+# Per cell: a bit set for its row, col and square, by their position in UNITS
+CELL_UNITS_BITS = tuple((1 << index // 9) | (1 << 9 + index % 9) | (1 << 18 + CELL_SQUARE[index])
+                        for index in range(81))
+# Per row or col and square that share 3 cells: (the shared cells, the other cells of the square,
+# the other cells of the row or col)
+INTERSECTIONS = tuple((tuple(sorted(set(line) & set(square))), tuple(sorted(set(square) - set(line))),
+                       tuple(sorted(set(line) - set(square))))
+                      for square in SQUARE_UNITS for line in ROW_UNITS + COL_UNITS if len(set(line) & set(square)) == 3)
+# The algo level 2 techniques, cheapest first: a Sudoku method name with its args
+LEVEL2_TECHNIQUES = (('remove_locked_values',), ('remove_naked_subsets', 2), ('remove_hidden_subsets', 2),
+                     ('remove_naked_subsets', 3), ('remove_hidden_subsets', 3), ('remove_fish', 2),
+                     ('remove_naked_subsets', 4), ('remove_hidden_subsets', 4), ('remove_fish', 3))
+
+
+def assign_value(values, available_values, index, value):
+    """
+    Set value to cell index of the flat values list and remove it from the avail values of its peers.
+    Peers left with a single avail value are assigned as well.
+    Returns False when a contradiction is found (values and available_values are then half updated).
+    """
+    to_assign = [(index, value)]
+    while to_assign:
+        index, value = to_assign.pop()
+        if values[index] is not None:
+            if values[index] != value:
+                return False
+            continue
+        values[index] = value
+        value_bit = 1 << value
+        for peer in PEERS[index]:
+            if values[peer] is None:
+                peer_avail_values = available_values[peer]
+                if peer_avail_values & value_bit:
+                    peer_avail_values &= ~value_bit
+                    if peer_avail_values == 0:
+                        return False
+                    available_values[peer] = peer_avail_values
+                    if MASK_SIZE[peer_avail_values] == 1:
+                        to_assign.append((peer, MASK_VALUES[peer_avail_values][0]))
+            elif values[peer] == value:
+                return False
+    return True
+
+
+def assign_hidden_singles(values, available_values):
+    """
+    Assign every value that is available in only one cell of a row, column or square, until there
+    are no more. Returns False when a contradiction is found.
+    """
+    assigned = True
+    while assigned:
+        assigned = False
+        for unit in UNITS:
+            once = 0
+            twice = 0
+            placed = 0
+            for index in unit:
+                if values[index] is None:
+                    twice |= once & available_values[index]
+                    once |= available_values[index]
+                else:
+                    placed |= 1 << values[index]
+            if (once | placed) != ALL_VALUES:
+                return False
+            singles = once & ~twice & ~placed
+            if singles:
+                for index in unit:
+                    if values[index] is None and available_values[index] & singles:
+                        if MASK_SIZE[available_values[index] & singles] > 1:
+                            return False
+                        if not assign_value(values, available_values, index,
+                                            MASK_VALUES[available_values[index] & singles][0]):
+                            return False
+                        assigned = True
+    return True
+
+
+def get_search_cell(values, available_values):
+    """
+    The non solved cell with the fewest avail values (the first one on a tie), or None when all are solved.
+    """
+    search_cell = None
+    search_cell_size = 10
+    for index in range(81):
+        if values[index] is None and MASK_SIZE[available_values[index]] < search_cell_size:
+            search_cell = index
+            search_cell_size = MASK_SIZE[available_values[index]]
+            if search_cell_size <= 1:
+                break
+    return search_cell
+
+
+def get_search_branches(values, available_values):
+    """
+    The (cell index, value) pairs to try next: the avail values of the cell with the fewest of them,
+    or, when all cells have more than 2, the cells of a row, column or square where a value is
+    available in fewer cells. Returns None when all cells are solved.
+    """
+    index = get_search_cell(values, available_values)
+    if index is None:
+        return None
+    branches = [(index, value) for value in MASK_VALUES[available_values[index]]]
+    if len(branches) > 2:
+        for unit in UNITS:
+            placed = 0
+            for unit_index in unit:
+                if values[unit_index] is not None:
+                    placed |= 1 << values[unit_index]
+            for value in MASK_VALUES[ALL_VALUES & ~placed]:
+                value_bit = 1 << value
+                value_branches = [(unit_index, value) for unit_index in unit
+                                  if values[unit_index] is None and available_values[unit_index] & value_bit]
+                if len(value_branches) < len(branches):
+                    branches = value_branches
+    return branches
+
+
+def search_solutions(values, available_values, solutions, limit, branches_left=None):
+    """
+    Depth first search over the flat values / available_values lists, always branching on the
+    fewest choices (see get_search_branches). Complete grids are appended to solutions.
+    Returns True once limit solutions were found.
+    branches_left, when given, is a one item list: the number of branches the search may still try.
+    The search gives up (returns True) once it is 0.
+    """
+    branches = get_search_branches(values, available_values)
+    if branches is None:
+        solutions.append(values)
+        return len(solutions) >= limit
+    for index, value in branches:
+        if branches_left is not None:
+            if branches_left[0] <= 0:
+                return True
+            branches_left[0] -= 1
+        values_copy = values[:]
+        available_values_copy = available_values[:]
+        if assign_value(values_copy, available_values_copy, index, value) and \
+                assign_hidden_singles(values_copy, available_values_copy) and \
+                search_solutions(values_copy, available_values_copy, solutions, limit, branches_left):
+            return True
+    return False
+
+
+def count_solutions(grid, limit=2, max_branches=10000):
+    """
+    The number of solutions of grid (9 lists of 9 values, None for an empty cell), counting up to limit:
+    with the default limit of 2, 0 for no solution, 1 for a single solution, 2 for more.
+    The givens are propagated (naked and hidden singles) before searching, as search_solutions does on
+    each branch. Returns None when the search tried max_branches branches (None for no bound) without
+    reaching limit nor trying all the branches.
+    """
+    values = [None] * 81
+    available_values = [ALL_VALUES] * 81
+    for index, value in enumerate(value for row in grid for value in row):
+        if value is not None and not assign_value(values, available_values, index, value):
+            return 0
+    if not assign_hidden_singles(values, available_values):
+        return 0
+    solutions = []
+    branches_left = None if max_branches is None else [max_branches]
+    if search_solutions(values, available_values, solutions, limit, branches_left) and len(solutions) < limit:
+        return None
+    return len(solutions)
+
+
+def sum_masks(masks, indexes):
+    """
+    The avail values of the cells of indexes together, from the list of masks of all the cells.
+    """
+    values_mask = 0
+    for index in indexes:
+        values_mask |= masks[index]
+    return values_mask
 
 
 class Color:
@@ -36,17 +245,54 @@ class Status:
     NOT_SOLVED_NOT_STUCK = -2
     STATUS_NOT_SET = -3
     MULTIPLE_NON_DECISIVE_PATHS = -4
+    PROBE_ABORTED = -5  # A bounded probe that stopped before knowing if it gets stuck, see get_steps_to_stuck
+
+
+class ProbeCache:
+    """
+    LRU cache of algo level 3 probe paths: from a board state a probe went through to the rest
+    of the path from that state on.
+    The entries belong to one state of the real board (see Sudoku.get_board_key), they are
+    dropped once it changes. A probe state is then keyed by the values set since that state
+    (see Sudoku.get_steps_to_stuck).
+    """
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.board_key = None
+        self.hits = 0
+        self.misses = 0
+
+    def set_board(self, board_key):
+        if board_key != self.board_key:
+            self.entries.clear()
+            self.board_key = board_key
+
+    def get(self, key):
+        path = self.entries.get(key)
+        if path is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return path
+
+    def put(self, key, path):
+        self.entries[key] = path
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
 
 
 class SudokuCell:
     def __init__(self, row, col, grid):
         self.row = row
         self.col = col
+        self.index = row * 9 + col
         self.value = None
-        self.available_values = []  # At the time of grid.solved_step
+        self.available_values = 0  # Bitmask, at the time of grid.solved_step
         self.solved_step = None
         self.grid = grid
-        self.square_cells = []
         self.from_trial = False
         self.steps_to_stuck = {}
 
@@ -55,26 +301,27 @@ class SudokuCell:
         result = cls.__new__(cls)
         memo_dict[id(self)] = result
         for k, v in self.__dict__.items():
-            if k == 'grid' or k == 'square_cells':
+            if k == 'grid':
                 v = None
             setattr(result, k, copy.deepcopy(v, memo_dict))
         return result
 
     def __str__(self):
         rv = f"Cell: row= {self.row} ,col= {self.col} ,value= {self.value} ,solved_step= {self.solved_step} " + \
-             f",available_values= {self.available_values[-1]}"
+             f",available_values= {list(MASK_VALUES[self.available_values])}"
         return rv
 
     def add_all_values(self):
-        self.available_values.append({1, 2, 3, 4, 5, 6, 7, 8, 9})
+        self.available_values = ALL_VALUES
 
     def solved(self, step, value, from_trial=False):
         self.value = value
         self.solved_step = step
         self.from_trial = from_trial
-        # self.available_values[-1] = {}
+        # self.available_values = {}
         if from_trial:
             self.grid.trial_on_step = step
+        self.grid.set_value_to_propagate(self)
 
     def get_lssfc(self):
         # lssfc is: longest surely stuck for cell i.e.:
@@ -90,9 +337,9 @@ class SudokuCell:
         for value in sorted(self.steps_to_stuck.keys()):
             status = self.steps_to_stuck[value][-1][0]
             if status < 0:
+                # Solved, or got stuck without a contradiction: the only value that may fit the cell.
                 negative_values_found += 1
-                if status == Status.SOLVED:
-                    value_for_cell = value
+                value_for_cell = value
 
             else:
                 lssfc_candidate = len(self.steps_to_stuck[value])
@@ -111,18 +358,6 @@ class SudokuCell:
             value_for_cell = Status.MULTIPLE_NON_DECISIVE_PATHS
         return lssfc, value_for_cell, lssfc_msg
 
-    def set_square_cells(self):
-        self.square_cells = []
-        min_row = self.row // 3 * 3
-        min_col = self.col // 3 * 3
-
-        # print(f"({self.row},{self.col}) min_row={min_row} ,min_col={min_col}")
-
-        for row in range(min_row, min_row + 3):
-            for col in range(min_col, min_col + 3):
-                # if row != self.row or col != self.col:
-                self.square_cells.append(self.grid.cells[row][col])
-
 
 class Sudoku:
     def __init__(self, verbose=1):
@@ -135,10 +370,8 @@ class Sudoku:
             self.cells.append(new_row)
 
         # self.cells = [[SudokuCell(row, col, self) for col in range(9)] for row in range(9)]
+        self.flat_cells = [cell for row in self.cells for cell in row]  # Indexed as in UNITS and PEERS
 
-        for row in range(9):
-            for col in range(9):
-                self.cells[row][col].set_square_cells()
         self.solved = True
         self.loaded = False
         self.solved_step = 0
@@ -157,6 +390,61 @@ class Sudoku:
         self.algo_level = 1
         self.is_copy = False
         self.non_solve_able_cell = None
+        self.unsolved_cells = 81
+        self.cells_to_propagate = []  # Cells that got a value since the last update_all_available_values
+        self.trail = []  # (cell, avail values before the change), for undo
+        self.steps = []  # (trail length when the step started, cell solved on the step), one per solved step
+        # Per (unit id, value) key: how many non solved cells of the unit have the value avail with the
+        # sum of their indexes (see INDEX_COUNT), the index of the cell when there is only one. And how many
+        # cells of the unit are set to the value. Kept up to date on every change, see index_unit_values.
+        self.unit_value_index = [0] * 270
+        self.unit_value_set = [0] * 270
+        # The deductions found pending while the avail values change, taken in order by solve_next_cell:
+        # a bit set for every cell index that may have only one avail value, and a bit set for every unit
+        # (by its position in UNITS) where a value may be avail in only one cell. A bit that no longer
+        # holds is cleared when it comes first, see get_naked_single and get_hidden_single.
+        self.pending_naked_singles = 0
+        self.pending_units = 0
+        self.level2_techniques = LEVEL2_TECHNIQUES
+        # The algo level 2 techniques of the algo level 3 probes. None by default: a probe gets stuck
+        # on algo level 1, running them would make the many probes that get stuck much slower.
+        self.probe_level2_techniques = ()
+        self.derived_removals = 0  # Avail values removed by algo level 2 so far
+        self.probe_executor = None  # A concurrent.futures executor to run the algo level 3 probes on, None: run here
+        self.probe_chunk_size = 8  # Probes per task sent to probe_executor
+        self.bounded_probes = True  # Stop the algo level 3 probes that can not beat the best cell found so far
+        self.probe_cache = ProbeCache()  # None: no caching of the algo level 3 probes
+
+    def reset(self):
+        """
+        Clear the loaded puzzle, so this board (and its cells) can load another one.
+        """
+        for cell in self.flat_cells:
+            cell.value = None
+            cell.available_values = 0
+            cell.solved_step = None
+            cell.from_trial = False
+            cell.steps_to_stuck = {}
+        self.solved = True
+        self.loaded = False
+        self.solved_step = 0
+        self.trial = None
+        self.trial_on_step = 100
+        self.solve_able = True
+        self.on = True
+        self.msg = "Go!"
+        self.msg_color = Color.BLUE
+        self.hint = False
+        self.algo_level = 1
+        self.non_solve_able_cell = None
+        self.unsolved_cells = 81
+        self.cells_to_propagate = []
+        self.trail = []
+        self.steps = []
+        self.unit_value_index = [0] * 270
+        self.unit_value_set = [0] * 270
+        self.pending_naked_singles = 0
+        self.pending_units = 0
 
     def __copy__(self):
         cls = self.__class__
@@ -171,9 +459,15 @@ class Sudoku:
                         new_row.append(copy.deepcopy(self.cells[row][col]))
                     cells_copy.append(new_row)
                 setattr(result, k, cells_copy)
+                result.flat_cells = [cell for row in cells_copy for cell in row]
                 continue
-            if k == 'text_font' or k == 'avail_font':
+            if k == 'flat_cells':
+                continue
+            if k == 'text_font' or k == 'avail_font' or k == 'probe_executor' or k == 'probe_cache':
                 v = None
+            if k == 'trail' or k == 'steps':
+                # A copy starts its own history
+                v = []
 
             setattr(result, k, copy.copy(v))
         return result
@@ -288,6 +582,8 @@ class Sudoku:
         self.print_text("In order to try a value use the following combination:", 7)
         self.print_text("     t[0-9][0-9][0-9]", 8)
         self.print_text("     First digit is raw, second is column, third is value.", 9)
+        self.print_text("3 -> solve a step with algo level 3; 4 -> solve a step by search.", 10)
+        self.print_text("e -> remove all the values algo level 3 finds stuck.", 11)
 
         self.print_text("Colors:", 12)
         self.print_text("Input cells.", 13)
@@ -349,7 +645,7 @@ class Sudoku:
                     self.solved = False
 
                     if self.show_available_values:
-                        for i, avail_value in enumerate(sorted(cell.available_values[self.solved_step])):
+                        for i, avail_value in enumerate(MASK_VALUES[cell.available_values]):
                             text = self.avail_font.render(str(avail_value), True, Color.GREEN)
                             draw_v = cell_size * row + (cell_size // 3) * (i // 3) + (cell_size // 3)
                             draw_h = cell_size * col + cell_size // 3 * (i % 3) + (cell_size // 3)
@@ -384,6 +680,12 @@ class Sudoku:
     def run(self):
         if not self.loaded:
             raise ValueError("Cant draw unloaded puzzle")
+        global pygame
+        try:
+            import pygame
+            import pygame.locals
+        except ImportError:
+            raise ImportError("pygame is needed in order to draw the puzzle")
 
         # https://betterprogramming.pub/making-grids-in-python-7cf62c95f413
 
@@ -419,10 +721,8 @@ class Sudoku:
 
         cell = self.cells[row][col]
         if cell.value is None:
-            if val in cell.available_values[self.solved_step]:
-                self.solved_step += 1
-                self.cells[row][col].solved(self.solved_step, val, True)
-                self.update_all_available_values(new_step=True)
+            if cell.available_values & (1 << val):
+                self.solve_cell(cell, val, from_trial=True)
                 self.msg = f"Trying {val} at ({row},{col})"
                 self.msg_color = Color.YELLOW
             else:
@@ -441,40 +741,173 @@ class Sudoku:
         Find the cell with the minimal LSSFC and show it as the next solvable.
         """
         self.algo_level = 3
-        self.update_all_available_values(new_step=False)
+        self.update_all_available_values()
+        if self.probe_cache is not None:
+            self.probe_cache.set_board(self.get_board_key())
         best_cell_to_solve = None
         best_cell_to_solve_LSSFC = None
         best_cell_to_solve_value = None
         best_cell_to_solve_msg = None
-        for row in range(9):
-            for col in range(9):
-                cell = self.cells[row][col]
-                lssfc, value_for_cell, msg = cell.get_lssfc()
-                if lssfc > 1 and (best_cell_to_solve_LSSFC is None or best_cell_to_solve_LSSFC > lssfc):
-                    best_cell_to_solve = cell
-                    best_cell_to_solve_LSSFC = lssfc
-                    best_cell_to_solve_value = value_for_cell
-                    best_cell_to_solve_msg = msg
-                    if self.verbose > 1:
-                        print(f'cell {cell} ,lssfc {lssfc} ,best_cell_to_solve_value {best_cell_to_solve_value}')
+        if self.bounded_probes and self.probe_executor is None:
+            best_cell_to_solve, best_cell_to_solve_LSSFC, best_cell_to_solve_value, best_cell_to_solve_msg = \
+                self.find_algo_level3_cell_bounded()
+        else:
+            if self.probe_executor is None:
+                for row in range(9):
+                    for col in range(9):
+                        cell = self.cells[row][col]
+                        if cell.value is None:
+                            self.apply_algo_level3_to_cell(cell)
+            else:
+                self.apply_algo_level3_in_executor()
+            for row in range(9):
+                for col in range(9):
+                    cell = self.cells[row][col]
+                    if cell.value is not None:
+                        # steps_to_stuck of solved cells is left over from previous rounds
+                        continue
+                    lssfc, value_for_cell, msg = cell.get_lssfc()
+                    if lssfc > 1 and value_for_cell > 0 and \
+                            (best_cell_to_solve_LSSFC is None or best_cell_to_solve_LSSFC > lssfc):
+                        best_cell_to_solve = cell
+                        best_cell_to_solve_LSSFC = lssfc
+                        best_cell_to_solve_value = value_for_cell
+                        best_cell_to_solve_msg = msg
+                        if self.verbose > 1:
+                            print(f'cell {cell} ,lssfc {lssfc} ,best_cell_to_solve_value {best_cell_to_solve_value}')
 
         if self.verbose > 0:
             print(f'Best cell to solve is {best_cell_to_solve}, with lssfc {best_cell_to_solve_LSSFC},' +
                   f'value_for_cell= {best_cell_to_solve_value}')
+        if self.verbose > 1 and self.probe_cache is not None:
+            print(f'Probe cache: hits= {self.probe_cache.hits} ,misses= {self.probe_cache.misses}')
 
         if best_cell_to_solve is None:
-            print("ALGO_LEVEL3 FAILED!!!, Call Amir 054-9574802 and get a reward!")
+            if self.verbose > 0:
+                print("ALGO_LEVEL3 FAILED!!!, Call Amir 054-9574802 and get a reward!")
         else:
-            self.solved_step += 1
-            best_cell_to_solve.solved(self.solved_step, best_cell_to_solve_value)
-
             self.msg = []
             self.msg.append(f"Cell ({best_cell_to_solve.row + 1}, {best_cell_to_solve.col + 1}): only " +
                             f"{best_cell_to_solve_value} is available in this cell.")
             for msg in best_cell_to_solve_msg:
                 self.msg.append(msg)
             self.algo_level = 1
-            self.update_all_available_values(new_step=True)
+            self.solve_cell(best_cell_to_solve, best_cell_to_solve_value)
+
+    def apply_algo_level3_eliminations(self):
+        """
+        Probe every avail value of every non solved cell, as apply_algo_level3 does, and remove
+        from the avail values all those that got stuck: each of them surely does not fit its cell.
+        The next steps go back to the cheaper algo levels, which usually find more now.
+        Return the number of values removed.
+        """
+        self.algo_level = 3
+        self.update_all_available_values()
+        if self.probe_cache is not None:
+            self.probe_cache.set_board(self.get_board_key())
+        if self.probe_executor is None:
+            for cell in self.flat_cells:
+                if cell.value is None:
+                    self.apply_algo_level3_to_cell(cell)
+        else:
+            self.apply_algo_level3_in_executor()
+        removed = 0
+        for cell in self.flat_cells:
+            if cell.value is not None:
+                continue
+            stuck_values = 0
+            for value, steps_to_stuck in cell.steps_to_stuck.items():
+                if steps_to_stuck[-1][0] >= 0:
+                    stuck_values |= 1 << value
+            if stuck_values:
+                removed += MASK_SIZE[stuck_values]
+                self.set_available_values(cell, cell.available_values & ~stuck_values)
+                if cell.available_values == 0 and self.solve_able:
+                    self.set_not_solve_able(cell)
+        self.algo_level = 1
+        if self.solve_able:
+            self.msg = f"Algo level 3 removed {removed} avail values that get stuck."
+            self.msg_color = Color.BLUE
+        if self.verbose > 0:
+            print(f'Algo level 3 eliminations: removed {removed} avail values')
+        return removed
+
+    def find_algo_level3_cell_bounded(self):
+        """
+        Find the cell apply_algo_level3 picks (the minimal lssfc, the first by row then col on
+        equal lssfc) with bounded probes, that stop once their cell can not be picked:
+        - Cells with fewer avail values are probed first. They tend to have short paths, so a
+          good bound is found early.
+        - A cell whose probes all got stuck within the bound, but one that was aborted, is picked
+          only if the aborted probe does not get stuck. Such cells are checked after the others,
+          in their lssfc order, by running the aborted probe without a bound.
+        Return (cell, lssfc, value for cell, msg), all None when no cell is found.
+        """
+        best = None  # (lssfc, cell index, value for cell, msg)
+        cells = sorted((cell for cell in self.flat_cells if cell.value is None),
+                       key=lambda cell: (MASK_SIZE[cell.available_values], cell.index))
+        aborted_cells = []
+        for cell in cells:
+            max_length = None
+            if best is not None:
+                # On equal lssfc the first cell (by row, then col) wins
+                max_length = best[0] if cell.index < best[1] else best[0] - 1
+            if not self.apply_algo_level3_to_cell(cell, max_length):
+                continue
+            lssfc, value_for_cell, msg = cell.get_lssfc()
+            if lssfc > 1 and value_for_cell > 0 and (best is None or (lssfc, cell.index) < best[:2]):
+                if cell.steps_to_stuck[value_for_cell][-1][0] == Status.PROBE_ABORTED:
+                    aborted_cells.append((lssfc, cell.index, value_for_cell))
+                else:
+                    best = (lssfc, cell.index, value_for_cell, msg)
+                    if self.verbose > 1:
+                        print(f'cell {cell} ,lssfc {lssfc} ,best_cell_to_solve_value {value_for_cell}')
+
+        for lssfc, index, value in sorted(aborted_cells):
+            if best is not None and (lssfc, index) > best[:2]:
+                break
+            cell = self.flat_cells[index]
+            cell.steps_to_stuck[value] = self.get_steps_to_stuck(cell, value)
+            lssfc, value_for_cell, msg = cell.get_lssfc()
+            if value_for_cell > 0:
+                best = (lssfc, index, value_for_cell, msg)
+                if self.verbose > 1:
+                    print(f'cell {cell} ,lssfc {lssfc} ,best_cell_to_solve_value {value_for_cell}')
+                break
+
+        if best is None:
+            return None, None, None, None
+        lssfc, index, value_for_cell, msg = best
+        return self.flat_cells[index], lssfc, value_for_cell, msg
+
+    def apply_algo_level4(self):
+        """
+        Search: starting from the current avail values, find a complete solution by depth first
+        search, and set the cell with the fewest avail values to its value in that solution.
+        The steps found so far are kept, and the next steps go back to the cheaper algo levels.
+        """
+        self.update_all_available_values()
+        if not self.solve_able:
+            return None
+        values = [cell.value for cell in self.flat_cells]
+        solutions = []
+        search_solutions(values, [cell.available_values for cell in self.flat_cells], solutions, 1)
+        if not solutions:
+            self.solve_able = False
+            self.msg = "Not solvable!!! Search found no solution"
+            self.msg_color = Color.RED
+            return None
+
+        index = get_search_cell(values, [cell.available_values for cell in self.flat_cells])
+        if index is None:
+            return None
+        cell = self.flat_cells[index]
+        value = solutions[0][index]
+        self.msg = f"Cell ({cell.row + 1}, {cell.col + 1}): search found a solution with {value} in this cell."
+        self.msg_color = Color.BLUE
+        self.algo_level = 1
+        self.solve_cell(cell, value)
+        return [cell.row, cell.col, value]
 
     def check_events(self):
         for event in pygame.event.get():
@@ -491,9 +924,15 @@ class Sudoku:
                     pygame.quit()
                     sys.exit()
 
-                if event.key == pygame.locals.K_3:
+                if event.key == pygame.locals.K_3 and self.trial is None:
                     self.apply_algo_level3()
 
+                if event.key == pygame.locals.K_4 and self.trial is None:
+                    self.apply_algo_level4()
+
+                if event.key == pygame.locals.K_e and self.trial is None:
+                    self.apply_algo_level3_eliminations()
+
                 if event.key == pygame.locals.K_v:
                     self.verbose += 1
                     print(f'Raised verbose to {self.verbose}')
@@ -550,17 +989,15 @@ class Sudoku:
             # Todo make sound
             pass
         else:
-            found = False
-            for row in range(9):
-                if not found:
-                    for col in range(9):
-                        cell = self.cells[row][col]
-                        cell.available_values.pop()
-                        if cell.value is not None:
-                            if cell.solved_step == self.solved_step:
-                                self.msg = f"Undo: deleted value {cell.value} from cell ({cell.row + 1},{cell.col + 1})"
-                                self.msg_color = Color.BLUE
-                                cell.value = None
+            trail_length, cell = self.steps.pop()
+            while len(self.trail) > trail_length:
+                trail_cell, available_values = self.trail.pop()
+                self.change_available_values(trail_cell, available_values)
+
+            self.msg = f"Undo: deleted value {cell.value} from cell ({cell.row + 1},{cell.col + 1})"
+            self.msg_color = Color.BLUE
+            self.unset_value(cell)
+            self.add_all_pending_singles()
 
             if self.trial_on_step == self.solved_step:
                 # undo trial
@@ -568,44 +1005,316 @@ class Sudoku:
             self.solved_step -= 1
             self.solved = False
 
-    def update_all_available_values(self, new_step):
-        self.solved = True
+    def solve_cell(self, cell, value, from_trial=False):
+        """
+        Start a new solved step by setting value to cell.
+        """
+        self.solved_step += 1
+        self.steps.append((len(self.trail), cell))
+        cell.solved(self.solved_step, value, from_trial)
+        self.update_all_available_values()
+
+    def update_all_available_values(self):
+        """
+        Bring the avail values up to date with the cells that got a value since the last call.
+        Only the peers of these cells are touched. On algo level 2 the derived values are
+        then removed, rechecking only around the cells whose avail values changed.
+        """
         self.non_solve_able_cell = None
-        while True:
-            avail_changed = False
-            derive_changed = False
-            for row in range(9):
-                for col in range(9):
-                    cell = self.cells[row][col]
-                    if new_step:
-                        cell.available_values.append(cell.available_values[-1].copy())
-                    if cell.value is None:
-                        self.solved = False
-                        avail_changed = self.update_available_values(cell) or avail_changed
-                        if len(cell.available_values[self.solved_step]) == 0:
-                            self.solve_able = False
-                            self.non_solve_able_cell = cell
-                            self.msg = f"Not solvable!!! cell ({cell.row + 1},{cell.col + 1}) has no avail values"
-                            self.msg_color = Color.RED
-
-            new_step = False
-            if self.algo_level > 1 and self.solve_able:
-                for row in range(9):
-                    for col in range(9):
-                        cell = self.cells[row][col]
-                        if cell.value is None:
-                            if self.algo_level == 2:
-                                derive_changed = self.remove_derived_values(cell) or derive_changed
-                                if len(cell.available_values[self.solved_step]) == 0:
-                                    self.msg = f"Not solvable!!! cell ({cell.row},{cell.col}) has no avail values"
-                                    self.msg_color = Color.RED
-                                    self.solve_able = False
-                                    self.non_solve_able_cell = cell
-                            if not self.is_copy and self.algo_level == 3:
-                                self.apply_algo_level3_to_cell(cell)
-
-            if not avail_changed and not derive_changed:
-                break
+        self.propagate_values()
+        if self.algo_level == 2 and self.solve_able:
+            self.remove_all_derived_values()
+        self.solved = self.unsolved_cells == 0
+
+    def set_available_values(self, cell, available_values):
+        self.trail.append((cell, cell.available_values))
+        if cell.value is None:
+            self.pending_naked_singles |= 1 << cell.index
+            self.pending_units |= CELL_UNITS_BITS[cell.index]
+        self.change_available_values(cell, available_values)
+
+    def change_available_values(self, cell, available_values):
+        """
+        Set the avail values of cell, keeping the unit values index up to date. Not recorded for undo,
+        nor marked pending.
+        """
+        if cell.value is None:
+            unit_value_index = self.unit_value_index
+            row_key, col_key, square_key = CELL_UNIT_KEYS[cell.index]
+            change = INDEX_COUNT + cell.index
+            for value in MASK_VALUES[cell.available_values & ~available_values]:
+                unit_value_index[row_key + value] -= change
+                unit_value_index[col_key + value] -= change
+                unit_value_index[square_key + value] -= change
+            for value in MASK_VALUES[available_values & ~cell.available_values]:
+                unit_value_index[row_key + value] += change
+                unit_value_index[col_key + value] += change
+                unit_value_index[square_key + value] += change
+        cell.available_values = available_values
+
+    def add_all_pending_singles(self):
+        """
+        Mark all the cells and units pending, e.g. after undo. The next calls of get_naked_single
+        and get_hidden_single clear what does not hold, each bit once.
+        """
+        self.pending_naked_singles = (1 << 81) - 1
+        self.pending_units = (1 << 27) - 1
+
+    def index_unit_values(self):
+        """
+        Build the unit values index (see __init__) from the cells. Needed only when cells are set
+        directly, e.g. on load. On every other change the index is updated.
+        """
+        self.unit_value_index = [0] * 270
+        self.unit_value_set = [0] * 270
+        for cell in self.flat_cells:
+            for unit_key in CELL_UNIT_KEYS[cell.index]:
+                if cell.value is not None:
+                    self.unit_value_set[unit_key + cell.value] += 1
+                    continue
+                for value in MASK_VALUES[cell.available_values]:
+                    self.unit_value_index[unit_key + value] += INDEX_COUNT + cell.index
+        self.add_all_pending_singles()
+
+    def set_value_to_propagate(self, cell):
+        """
+        Called once cell got its value.
+        """
+        self.unsolved_cells -= 1
+        self.cells_to_propagate.append(cell)
+        self.index_cell_value(cell, -1)
+        self.pending_units |= CELL_UNITS_BITS[cell.index]
+
+    def unset_value(self, cell):
+        cell.value, value = None, cell.value
+        self.unsolved_cells += 1
+        self.index_cell_value(cell, 1, value)
+
+    def index_cell_value(self, cell, change, value=None):
+        """
+        Update the unit values index when cell leaves (change -1, on solving) or joins (change 1,
+        on undo) the non solved cells. value is the value the cell had, when it no longer has it.
+        """
+        value = value or cell.value
+        unit_value_index = self.unit_value_index
+        index_change = change * (INDEX_COUNT + cell.index)
+        for unit_key in CELL_UNIT_KEYS[cell.index]:
+            self.unit_value_set[unit_key + value] -= change
+            for avail_value in MASK_VALUES[cell.available_values]:
+                unit_value_index[unit_key + avail_value] += index_change
+
+    def get_peers(self, cell):
+        """
+        The 20 cells that share a row, column or square with cell.
+        """
+        return [self.flat_cells[index] for index in PEERS[cell.index]]
+
+    def propagate_values(self):
+        """
+        Remove the value of every cell waiting in cells_to_propagate from the avail values
+        of its peers. Returns the cells whose avail values changed.
+        """
+        changed_cells = []
+        no_avail_cells = []
+        unit_value_index = self.unit_value_index
+        pending_naked_singles = self.pending_naked_singles
+        pending_units = self.pending_units
+        while self.cells_to_propagate:
+            solved_cell = self.cells_to_propagate.pop()
+            value = solved_cell.value
+            value_bit = 1 << value
+            for index in PEERS[solved_cell.index]:
+                peer = self.flat_cells[index]
+                if peer.value is None and peer.available_values & value_bit:
+                    if self.verbose > 2:
+                        print(f"cell={peer.row},{peer.col}: removing value of {solved_cell.value} found at " +
+                              f"({solved_cell.row},{solved_cell.col}) from avail values")
+                    # set_available_values, with the index update of the single value removed
+                    self.trail.append((peer, peer.available_values))
+                    peer.available_values &= ~value_bit
+                    row_key, col_key, square_key = CELL_UNIT_KEYS[index]
+                    change = INDEX_COUNT + index
+                    unit_value_index[row_key + value] -= change
+                    unit_value_index[col_key + value] -= change
+                    unit_value_index[square_key + value] -= change
+                    pending_units |= CELL_UNITS_BITS[index]
+                    changed_cells.append(peer)
+                    if MASK_SIZE[peer.available_values] == 1:
+                        pending_naked_singles |= 1 << index
+                    elif peer.available_values == 0:
+                        no_avail_cells.append(peer)
+        self.pending_naked_singles = pending_naked_singles
+        self.pending_units = pending_units
+
+        if no_avail_cells:
+            self.set_not_solve_able(max(no_avail_cells, key=lambda c: (c.row, c.col)))
+        return changed_cells
+
+    def set_not_solve_able(self, cell):
+        self.solve_able = False
+        self.non_solve_able_cell = cell
+        self.msg = f"Not solvable!!! cell ({cell.row + 1},{cell.col + 1}) has no avail values"
+        self.msg_color = Color.RED
+
+    def remove_all_derived_values(self):
+        """
+        Algo level 2: remove the avail values derived by the techniques of level2_techniques, cheapest
+        first. After a technique removed values, start again from the cheapest one. Stop as soon as
+        there is a single to solve, or no technique removes anything.
+        """
+        while self.solve_able and not self.has_single():
+            for technique in self.level2_techniques:
+                if getattr(self, technique[0])(*technique[1:]):
+                    break
+            else:
+                return
+
+    def has_single(self):
+        # The Sudoku methods, which are up to date on every change
+        return Sudoku.get_naked_single(self) is not None or \
+            any(Sudoku.get_hidden_single(self, units) is not None for units in (ROW_UNITS, COL_UNITS, SQUARE_UNITS))
+
+    def remove_values(self, indexes, values_mask, technique):
+        """
+        Remove the values of values_mask from the avail values of the non solved cells of indexes.
+        Return the number of cells changed.
+        """
+        removed = 0
+        for index in indexes:
+            cell = self.flat_cells[index]
+            if cell.value is None and cell.available_values & values_mask:
+                if self.verbose > 2:
+                    print(f"cell={cell.row},{cell.col}: {technique}, removing values of " +
+                          f"{list(MASK_VALUES[cell.available_values & values_mask])} from avail values")
+                self.set_available_values(cell, cell.available_values & ~values_mask)
+                self.derived_removals += 1
+                removed += 1
+                if cell.available_values == 0:
+                    self.set_not_solve_able(cell)
+                    break
+        return removed
+
+    def get_masks(self):
+        """
+        The avail values of every cell, 0 for a solved cell.
+        """
+        return [0 if cell.value is not None else cell.available_values for cell in self.flat_cells]
+
+    def remove_locked_values(self):
+        """
+        Pointing and box/line reduction: when a value of a square is avail only in the cells it shares
+        with a row or col, it is not avail in the other cells of the row or col. And when a value of
+        a row or col is avail only in the cells it shares with a square, it is not avail in the other
+        cells of the square.
+        """
+        removed = 0
+        masks = self.get_masks()
+        for shared, square_rest, line_rest in INTERSECTIONS:
+            shared_values = masks[shared[0]] | masks[shared[1]] | masks[shared[2]]
+            square_values = sum_masks(masks, square_rest)
+            line_values = sum_masks(masks, line_rest)
+            intersection_removed = 0
+            if shared_values & ~square_values & line_values:
+                intersection_removed = self.remove_values(line_rest, shared_values & ~square_values, 'pointing')
+            elif shared_values & ~line_values & square_values:
+                intersection_removed = self.remove_values(square_rest, shared_values & ~line_values,
+                                                          'box/line reduction')
+            if intersection_removed:
+                removed += intersection_removed
+                if not self.solve_able:
+                    break
+                masks = self.get_masks()
+        return removed
+
+    def remove_naked_subsets(self, size):
+        """
+        Naked subsets: when size cells of a unit have together only size avail values, these values
+        are not avail in the other cells of the unit.
+        """
+        removed = 0
+        masks = self.get_masks()
+        for unit in UNITS:
+            subset_cells = [index for index in unit if 2 <= MASK_SIZE[masks[index]] <= size]
+            if len(subset_cells) < size:
+                continue
+            for subset in itertools.combinations(subset_cells, size):
+                values_mask = 0
+                for index in subset:
+                    values_mask |= masks[index]
+                if MASK_SIZE[values_mask] == size:
+                    unit_removed = self.remove_values([index for index in unit if index not in subset], values_mask,
+                                                      f'naked subset of {size}')
+                    if unit_removed:
+                        removed += unit_removed
+                        if not self.solve_able:
+                            return removed
+                        masks = self.get_masks()
+                        break
+        return removed
+
+    def remove_hidden_subsets(self, size):
+        """
+        Hidden subsets: when size values of a unit are avail only in the same size cells, no other
+        value is avail in these cells.
+        """
+        removed = 0
+        masks = self.get_masks()
+        for unit in UNITS:
+            # Per value, the positions in unit of the cells where it is avail: bit position + 1 set, as in
+            # the avail values
+            positions = [0] * 10
+            for position, index in enumerate(unit):
+                for value in MASK_VALUES[masks[index]]:
+                    positions[value] |= 2 << position
+            values = [value for value in range(1, 10) if 2 <= MASK_SIZE[positions[value]] <= size]
+            for subset in itertools.combinations(values, size):
+                positions_mask = 0
+                for value in subset:
+                    positions_mask |= positions[value]
+                if MASK_SIZE[positions_mask] == size:
+                    values_mask = sum(1 << value for value in subset)
+                    unit_removed = self.remove_values([unit[position - 1] for position in MASK_VALUES[positions_mask]],
+                                                      ALL_VALUES & ~values_mask, f'hidden subset of {size}')
+                    if unit_removed:
+                        removed += unit_removed
+                        if not self.solve_able:
+                            return removed
+                        masks = self.get_masks()
+                        break
+        return removed
+
+    def remove_fish(self, size):
+        """
+        X-wing (size 2) and swordfish (size 3): when in size rows a value is avail only in the same size
+        cols, it is not avail in the other cells of these cols. The same with cols and rows swapped.
+        """
+        # Per value, the positions of the value in each row (the cols where it is avail, as in
+        # remove_hidden_subsets) and in each col
+        row_positions = [[0] * 9 for _ in range(10)]
+        col_positions = [[0] * 9 for _ in range(10)]
+        for cell in self.flat_cells:
+            if cell.value is None:
+                for value in MASK_VALUES[cell.available_values]:
+                    row_positions[value][cell.row] |= 2 << cell.col
+                    col_positions[value][cell.col] |= 2 << cell.row
+        for lines, cross_lines, positions in ((ROW_UNITS, COL_UNITS, row_positions),
+                                              (COL_UNITS, ROW_UNITS, col_positions)):
+            for value in range(1, 10):
+                fish_lines = [(line, line_positions) for line, line_positions in zip(lines, positions[value])
+                              if 2 <= MASK_SIZE[line_positions] <= size]
+                for subset in itertools.combinations(fish_lines, size):
+                    positions_mask = 0
+                    for _, line_positions in subset:
+                        positions_mask |= line_positions
+                    if MASK_SIZE[positions_mask] == size:
+                        fish_cells = set().union(*(line for line, _ in subset))
+                        other_indexes = [index for position in MASK_VALUES[positions_mask]
+                                         for index in cross_lines[position - 1] if index not in fish_cells]
+                        removed = self.remove_values(other_indexes, 1 << value,
+                                                     'x-wing' if size == 2 else f'fish of {size}')
+                        if removed:
+                            return removed
+        return 0
 
     def get_copy(self):
         puzzle_copy = copy.copy(self)
@@ -613,82 +1322,243 @@ class Sudoku:
         for row in range(9):
             for col in range(9):
                 puzzle_copy.cells[row][col].grid = puzzle_copy
-                puzzle_copy.cells[row][col].set_square_cells()
         return puzzle_copy
 
-    def get_steps_to_stuck(self, cell, value):
+    def snapshot(self):
+        """
+        Remember the current state of the board. Taking a snapshot copies no cells: restore()
+        goes back to it by undoing the trail and steps recorded after it. Back to the same board,
+        the singles pending then are pending again.
+        """
+        return (len(self.trail), len(self.steps), self.solved_step, self.algo_level, self.msg, self.msg_color,
+                self.hint, self.solved, self.solve_able, self.non_solve_able_cell, self.unsolved_cells,
+                self.pending_naked_singles, self.pending_units)
+
+    def restore(self, snapshot):
+        trail_length, steps_length, self.solved_step, self.algo_level, self.msg, self.msg_color, \
+            self.hint, self.solved, self.solve_able, self.non_solve_able_cell, self.unsolved_cells, \
+            self.pending_naked_singles, self.pending_units = snapshot
+        unsolved_cells = self.unsolved_cells
+        while len(self.steps) > steps_length:
+            _, cell = self.steps.pop()
+            self.unset_value(cell)
+        while len(self.trail) > trail_length:
+            trail_cell, available_values = self.trail.pop()
+            self.change_available_values(trail_cell, available_values)
+        self.unsolved_cells = unsolved_cells
+        self.cells_to_propagate = []
+
+    def get_state(self):
+        """
+        The part of the board a probe depends on, as plain values that can be sent to another process.
+        """
+        non_solve_able_index = None if self.non_solve_able_cell is None else self.non_solve_able_cell.index
+        return (tuple(cell.value for cell in self.flat_cells), tuple(cell.available_values for cell in self.flat_cells),
+                self.algo_level, self.solve_able, non_solve_able_index, self.level2_techniques,
+                self.probe_level2_techniques)
+
+    def load_state(self, state):
+        """
+        Reset the board and load a state returned by get_state().
+        """
+        values, available_values, algo_level, solve_able, non_solve_able_index, self.level2_techniques, \
+            self.probe_level2_techniques = state
+        self.reset()
+        self.loaded = True
+        for cell, value, cell_available_values in zip(self.flat_cells, values, available_values):
+            cell.value = value
+            cell.available_values = cell_available_values
+            if value is not None:
+                cell.solved_step = 0
+                self.unsolved_cells -= 1
+        self.solved = self.unsolved_cells == 0
+        self.algo_level = algo_level
+        self.solve_able = solve_able
+        if non_solve_able_index is not None:
+            self.non_solve_able_cell = self.flat_cells[non_solve_able_index]
+        self.index_unit_values()
+
+    def get_board_key(self):
+        """
+        A compact key of the board state: the cells values, the avail values of the non solved
+        cells and the algo level.
+        """
+        return bytes([self.algo_level]) + array.array('h', [cell.available_values if cell.value is None
+                                                            else -cell.value for cell in self.flat_cells]).tobytes()
+
+    def get_steps_to_stuck(self, cell, value, max_length=None):
+        """
+        Probe: set value to cell and solve with the cheap algo levels until solved or stuck. On algo
+        level 2 the probe uses probe_level2_techniques.
+        The probe runs on this board, which is restored afterwards.
+        With max_length, the probe stops (ending with Status.PROBE_ABORTED) once getting stuck
+        would take a path longer than max_length, the length of the returned list.
+        With probe_cache, a probe that gets to a state a previous probe went through takes the
+        rest of the path from the cache.
+        """
+        # Until algo level 2 removes derived values, probes only remove the values of solved cells from
+        # their peers, so the state of a probe is the state of the board before the probe, with the
+        # values set so far. These are the bits (cell index * 9 + value - 1) of probe_values. Once
+        # derived values are removed, the probe goes on without the cache.
+        probe_values = 1 << (cell.index * 9 + value - 1)
+        derived_removals = self.derived_removals
         rv = []
-        puzzle_copy = self.get_copy()
-        puzzle_copy.cells[cell.row][cell.col].value = value
-        puzzle_copy.verbose = 2
-        puzzle_copy.update_all_available_values(new_step=False)
+        snapshot = self.snapshot()
+        verbose = self.verbose
+        self.verbose = min(verbose, 2)
+        level2_techniques = self.level2_techniques
+        self.level2_techniques = self.probe_level2_techniques
+        self.solve_cell(cell, value)
         rv.append([cell.row, cell.col, value])
         next_solved_cell = True
-        while puzzle_copy.solve_able and next_solved_cell is not None and not puzzle_copy.solved:
-            next_solved_cell = puzzle_copy.solve_next_cell()
+        aborted = False
+        cached_path = None
+        keys = []  # (key of a state this probe went through, length of rv on that state)
+        while self.solve_able and next_solved_cell is not None and not self.solved:
+            if self.probe_cache is not None and self.derived_removals == derived_removals:
+                key = (probe_values, self.algo_level)
+                cached_path = self.probe_cache.get(key)
+                if cached_path is not None:
+                    rv.extend(cached_path)
+                    break
+                keys.append((key, len(rv)))
+            if max_length is not None and len(rv) + 2 > max_length:
+                # Getting stuck takes at least one more solved cell and the stuck entry
+                aborted = True
+                break
+            next_solved_cell = self.solve_next_cell()
             if next_solved_cell is not None:
                 rv.append(next_solved_cell)
-        if puzzle_copy.solved:
+                probe_values |= 1 << ((next_solved_cell[0] * 9 + next_solved_cell[1]) * 9 + next_solved_cell[2] - 1)
+        if cached_path is not None:
+            pass
+        elif aborted:
+            rv.append([Status.PROBE_ABORTED, 0, 0])
+        elif self.solved:
             rv.append([Status.SOLVED, 0, 0])
-        elif puzzle_copy.solve_able:
+        elif self.solve_able:
             rv.append([Status.NOT_SOLVED_NOT_STUCK, 0, 0])
         else:
-            rv.append([puzzle_copy.non_solve_able_cell.row, puzzle_copy.non_solve_able_cell.col, 'x'])
+            rv.append([self.non_solve_able_cell.row, self.non_solve_able_cell.col, 'x'])
+        if not aborted:
+            for key, length in keys:
+                self.probe_cache.put(key, rv[length:])
+        self.restore(snapshot)
+        self.verbose = verbose
+        self.level2_techniques = level2_techniques
         return rv
 
-    def apply_algo_level3_to_cell(self, cell):
+    def apply_algo_level3_to_cell(self, cell, max_length=None):
+        """
+        Probe every avail value of cell into cell.steps_to_stuck.
+        With max_length, the cell is only of use if its lssfc is at most max_length. Probing stops
+        as soon as it can not be, and False is returned. Otherwise True is returned, and one of the
+        probes may be aborted: the single value not stuck if it does not get stuck later.
+        """
         # Clean previous found values
         value = None
         cell.steps_to_stuck = {}
-        for value in sorted(cell.available_values[-1]):
-            cell.steps_to_stuck[value] = self.get_steps_to_stuck(cell, value)
+        not_stuck_values_found = 0
+        for value in MASK_VALUES[cell.available_values]:
+            steps_to_stuck = self.get_steps_to_stuck(cell, value, max_length)
+            cell.steps_to_stuck[value] = steps_to_stuck
+            if max_length is None:
+                continue
+            if steps_to_stuck[-1][0] < 0:
+                # Negative or aborted. Besides a negative value, an aborted probe is either another
+                # negative value or stuck on a path longer than max_length.
+                not_stuck_values_found += 1
+                if not_stuck_values_found > 1:
+                    return False
+            elif len(steps_to_stuck) > max_length:
+                return False
         if self.verbose > 1:
             print(f'AL3 {cell} val {value} sts={cell.steps_to_stuck}')
+        return True
 
-    def remove_derived_values(self, cell):
-        changed = self.remove_non_available_values(cell, 'row_derived')
-        changed = changed or self.remove_non_available_values(cell, 'col_derived')
-        changed = changed or self.remove_non_available_values(cell, 'square_derived')
-        return changed
-
-    def update_available_values(self, cell):
-        changed = self.remove_non_available_values(cell, 'row')
-        changed = self.remove_non_available_values(cell, 'col') or changed
-        changed = self.remove_non_available_values(cell, 'square') or changed
-        return changed
+    def apply_algo_level3_in_executor(self):
+        """
+        Same as calling apply_algo_level3_to_cell for every non solved cell, with the probes
+        sent in chunks to self.probe_executor. Each task gets the board state (see get_state)
+        and the results are merged back into the cells in the serial order.
+        """
+        state = self.get_state()
+        cells = [cell for cell in self.flat_cells if cell.value is None]
+        probes = [(cell.index, value) for cell in cells for value in MASK_VALUES[cell.available_values]]
+        futures = [self.probe_executor.submit(get_steps_to_stuck_in_worker, state,
+                                              probes[start:start + self.probe_chunk_size])
+                   for start in range(0, len(probes), self.probe_chunk_size)]
+        for cell in cells:
+            cell.steps_to_stuck = {}
+        results = [steps_to_stuck for future in futures for steps_to_stuck in future.result()]
+        for (index, value), steps_to_stuck in zip(probes, results):
+            self.flat_cells[index].steps_to_stuck[value] = steps_to_stuck
+        if self.verbose > 1:
+            for cell in cells:
+                print(f'AL3 {cell} sts={cell.steps_to_stuck}')
 
     def show_hint(self, cell):
         pass
 
+    def get_naked_single(self):
+        """
+        The first non solved cell (by row, then col) with only one avail value, or None.
+        Only the cells pending in pending_naked_singles are checked. The cell found stays pending.
+        """
+        pending = self.pending_naked_singles
+        while pending:
+            index = (pending & -pending).bit_length() - 1
+            cell = self.flat_cells[index]
+            if cell.value is None and MASK_SIZE[cell.available_values] == 1:
+                self.pending_naked_singles = pending
+                return cell
+            pending &= pending - 1
+        self.pending_naked_singles = 0
+        return None
+
+    def get_hidden_single(self, units):
+        """
+        Look for a value that is not set in a unit, and is avail in only one of its cells.
+        units are ROW_UNITS, COL_UNITS or SQUARE_UNITS, checked unit by unit, value by value.
+        Each check is a lookup in the unit values index, for the units pending in pending_units only.
+        The unit found stays pending.
+        Return (cell, value) for the first found, or None.
+        """
+        unit_value_index = self.unit_value_index
+        value_set = self.unit_value_set
+        first_unit = FIRST_UNIT_KEY[units] // 10
+        pending = (self.pending_units >> first_unit) & 0x1ff
+        while pending:
+            unit = first_unit + (pending & -pending).bit_length() - 1
+            for key in range(unit * 10 + 1, unit * 10 + 10):
+                if unit_value_index[key] >> 10 == 1 and not value_set[key]:
+                    return self.flat_cells[unit_value_index[key] - INDEX_COUNT], key % 10
+            pending &= pending - 1
+            self.pending_units &= ~(1 << unit)
+        return None
+
     def solve_next_cell(self):
         # Find cells that have unique values
         rv = None
-        for row in range(9):
-            if rv is None and self.solve_able:
-                for col in range(9):
-                    cell = self.cells[row][col]
-                    if cell.value is None:
-                        if len(cell.available_values[self.solved_step]) == 1:
-                            if self.hint:
-                                self.hint = cell
-                                self.msg = f"Cell ({cell.row + 1}, {cell.col + 1}): only ? is available " + \
-                                           "in this cell."
-                                self.msg_color = Color.BLUE
-                                value = None
-                            else:
-                                value = list(cell.available_values[self.solved_step])[0]
-                                self.solved_step += 1
-                                cell.solved(self.solved_step, value)
-                                self.update_all_available_values(new_step=True)
-                                if self.solve_able:
-                                    self.msg = f"Cell ({cell.row + 1}, {cell.col + 1}): only {value} is available " + \
-                                            "in this cell."
-                                    self.msg_color = Color.BLUE
-                                if self.verbose > 2:
-                                    print(f'solved step= {self.solved_step} ,{self.msg}')
-                                    # playsound('slice.wav')
-                            rv = [row, col, value]
-                            break
+        cell = self.get_naked_single() if self.solve_able else None
+        if cell is not None:
+            if self.hint:
+                self.hint = cell
+                self.msg = f"Cell ({cell.row + 1}, {cell.col + 1}): only ? is available " + \
+                           "in this cell."
+                self.msg_color = Color.BLUE
+                value = None
+            else:
+                value = MASK_VALUES[cell.available_values][0]
+                self.solve_cell(cell, value)
+                if self.solve_able:
+                    self.msg = f"Cell ({cell.row + 1}, {cell.col + 1}): only {value} is available " + \
+                            "in this cell."
+                    self.msg_color = Color.BLUE
+                if self.verbose > 2:
+                    print(f'solved step= {self.solved_step} ,{self.msg}')
+                    # playsound('slice.wav')
+            rv = [cell.row, cell.col, value]
 
         if rv is None and self.solve_able:
             # There is no cell with single value available
@@ -701,8 +1571,9 @@ class Sudoku:
         if self.algo_level < 2 and rv is None:
             if self.verbose > 2:
                 print("Using algo level 2")
-            self.update_all_available_values(new_step=False)
+            # On algo level 2, updating the avail values removes the derived values too
             self.algo_level = 2
+            self.update_all_available_values()
             return self.solve_next_cell()
 
         # if self.algo_level < 3 and not solved_cell and not self.is_copy:
@@ -711,7 +1582,7 @@ class Sudoku:
             # self.algo_level = 3
             # For each non solved cell try every avail value. Among the values tried and found they make the puzzle not
             # solvable, remove the one that makes the puzzle not solvable in the minimal steps.
-            # self.update_all_available_values(new_step=False)
+            # self.update_all_available_values()
 
         if rv is not None:
             self.algo_level = 1
@@ -720,232 +1591,65 @@ class Sudoku:
 
     def find_value_avail_once_in_row(self):
         rv = None
-        value_avail_in_col = None
-        for row in range(9):
-            if rv is None:
-                for value in range(1, 10):
-                    value_found = False
-                    value_avail_found_times = 0
-                    for col in range(9):
-                        if self.cells[row][col].value == value:
-                            # Found value in orw. No need to look for its available columns
-                            value_found = True
-                            break
-                        elif self.cells[row][col].value is None and \
-                                value in self.cells[row][col].available_values[self.solved_step]:
-                            value_avail_in_col = col
-                            value_avail_found_times += 1
-                            if value_avail_found_times > 1:
-                                # No need to check this value anymore (fow now...)
-                                break
-                    if not value_found and value_avail_found_times == 1:
-                        if self.hint:
-                            self.hint = self.cells[row][value_avail_in_col]
-                            self.msg = f"Row {row + 1}: ? is only available in column {value_avail_in_col + 1}."
-                            self.msg_color = Color.BLUE
-                        else:
-                            self.solved_step += 1
-                            self.cells[row][value_avail_in_col].solved(self.solved_step, value)
-                            self.update_all_available_values(new_step=True)
-                            self.msg = f"Row {row + 1}: {value} is only available in column {value_avail_in_col + 1}."
-                            self.msg_color = Color.BLUE
-                            if self.verbose > 2:
-                                print(f'solved step= {self.solved_step} ,{self.msg}')
-                        rv = [row, value_avail_in_col, value]
-                        # playsound('slice.wav')
-                        break
+        hidden_single = self.get_hidden_single(ROW_UNITS)
+        if hidden_single is not None:
+            cell, value = hidden_single
+            row = cell.row
+            value_avail_in_col = cell.col
+            if self.hint:
+                self.hint = cell
+                self.msg = f"Row {row + 1}: ? is only available in column {value_avail_in_col + 1}."
+                self.msg_color = Color.BLUE
+            else:
+                self.solve_cell(cell, value)
+                self.msg = f"Row {row + 1}: {value} is only available in column {value_avail_in_col + 1}."
+                self.msg_color = Color.BLUE
+                if self.verbose > 2:
+                    print(f'solved step= {self.solved_step} ,{self.msg}')
+            rv = [row, value_avail_in_col, value]
+            # playsound('slice.wav')
         return rv
 
     def find_value_avail_once_in_col(self):
         rv = None
-        value_avail_in_row = None
-        for col in range(9):
-            if rv is None:
-                for value in range(1, 10):
-                    value_found = False
-                    value_avail_found_times = 0
-                    for row in range(9):
-                        if self.cells[row][col].value == value:
-                            # Found value in orw. No need to look for its available columns
-                            value_found = True
-                            break
-                        elif self.cells[row][col].value is None and \
-                                value in self.cells[row][col].available_values[self.solved_step]:
-                            value_avail_in_row = row
-                            value_avail_found_times += 1
-                            if value_avail_found_times > 1:
-                                # No need to check this value anymore (fow now...)
-                                break
-                    if not value_found and value_avail_found_times == 1:
-                        if self.hint:
-                            self.hint = self.cells[value_avail_in_row][col]
-                            self.msg = f"Col {col + 1}: ? is only available in raw {value_avail_in_row + 1}."
-                            self.msg_color = Color.BLUE
-                        else:
-                            self.solved_step += 1
-                            self.cells[value_avail_in_row][col].solved(self.solved_step, value)
-                            self.update_all_available_values(new_step=True)
-                            self.msg = f"Col {col + 1}: {value} is only available in raw {value_avail_in_row + 1}."
-                            self.msg_color = Color.BLUE
-                            if self.verbose > 2:
-                                print(f'solved step= {self.solved_step} ,{self.msg}')
-                        rv = [value_avail_in_row, col, value]
-                        break
+        hidden_single = self.get_hidden_single(COL_UNITS)
+        if hidden_single is not None:
+            cell, value = hidden_single
+            col = cell.col
+            value_avail_in_row = cell.row
+            if self.hint:
+                self.hint = cell
+                self.msg = f"Col {col + 1}: ? is only available in raw {value_avail_in_row + 1}."
+                self.msg_color = Color.BLUE
+            else:
+                self.solve_cell(cell, value)
+                self.msg = f"Col {col + 1}: {value} is only available in raw {value_avail_in_row + 1}."
+                self.msg_color = Color.BLUE
+                if self.verbose > 2:
+                    print(f'solved step= {self.solved_step} ,{self.msg}')
+            rv = [value_avail_in_row, col, value]
         return rv
 
     def find_value_avail_once_in_square(self):
         rv = None
-        value_avail_in_row = None
-        value_avail_in_col = None
-        for row in range(0, 9, 3):
-            if rv is None:
-                for col in range(0, 9, 3):
-                    if rv is None:
-                        for value in range(1, 10):
-                            value_found = False
-                            value_avail_found_times = 0
-                            up_left_cell = self.cells[row][col]
-                            for cell_in_square in up_left_cell.square_cells:
-                                if cell_in_square.value == value:
-                                    # Found value in square. No need to look for its available columns
-                                    value_found = True
-                                    break
-                                elif cell_in_square.value is None and \
-                                        value in cell_in_square.available_values[self.solved_step]:
-                                    value_avail_in_row = cell_in_square.row
-                                    value_avail_in_col = cell_in_square.col
-                                    value_avail_found_times += 1
-                                    if value_avail_found_times > 1:
-                                        # No need to check this value anymore (fow now...)
-                                        break
-                            if not value_found and value_avail_found_times == 1:
-                                if self.hint:
-                                    self.hint = self.cells[value_avail_in_row][value_avail_in_col]
-                                    self.msg = f"? is only available in cell ({value_avail_in_row + 1}" + \
-                                        f",{value_avail_in_col + 1} in this square"
-                                else:
-                                    self.solved_step += 1
-                                    self.cells[value_avail_in_row][value_avail_in_col].solved(self.solved_step, value)
-                                    self.update_all_available_values(new_step=True)
-
-                                    self.msg = f"{value} is only available in cell ({value_avail_in_row+1}" + \
-                                               f",{value_avail_in_col + 1} in this square"
-                                    if self.verbose > 2:
-                                        print(f'solved step= {self.solved_step} ,{self.msg}')
-                                rv = [value_avail_in_row, value_avail_in_col, value]
-                                break
-        return rv
-
-    def remove_non_available_value(self, cell, row, col, remove_type):
-        removed = False
-        cell_to_look_at = self.cells[row][col]
-        if cell_to_look_at.value is not None and cell_to_look_at.value in cell.available_values[self.solved_step]:
-            if self.verbose > 2:
-                print(f"cell={cell.row},{cell.col}: removing value of {cell_to_look_at.value} found at ({row}" +
-                      f",{col}) from avail values (same {remove_type})")
-            cell.available_values[self.solved_step].remove(cell_to_look_at.value)
-            removed = True
-        return removed
-
-    def remove_non_avail_row_derived(self, cell):
-        """
-        See remove_non_avail_square_derived
-        """
-        removed = False
-        cells_with_similar_avail_values = []
-
-        for col in range(9):
-            if cell.available_values[self.solved_step] == \
-                    self.cells[cell.row][col].available_values[self.solved_step]:
-                cells_with_similar_avail_values.append(self.cells[cell.row][col])
-        if len(cells_with_similar_avail_values) == len(cell.available_values[self.solved_step]):
-            for col in range(9):
-                if self.cells[cell.row][col].value is None:
-                    if self.cells[cell.row][col] not in cells_with_similar_avail_values:
-                        for value in cell.available_values[self.solved_step]:
-                            if value in self.cells[cell.row][col].available_values[self.solved_step]:
-                                self.cells[cell.row][col].available_values[self.solved_step].remove(value)
-                                removed = True
-        return removed
-
-    def remove_non_avail_col_derived(self, cell):
-        """
-        See remove_non_avail_square_derived
-        """
-        removed = False
-        cells_with_similar_avail_values = []
-
-        for row in range(9):
-            if cell.available_values[self.solved_step] == \
-                    self.cells[row][cell.col].available_values[self.solved_step]:
-                cells_with_similar_avail_values.append(self.cells[row][cell.col])
-        if len(cells_with_similar_avail_values) == len(cell.available_values[self.solved_step]):
-            for row in range(9):
-                if self.cells[row][cell.col].value is None:
-                    if self.cells[row][cell.col] not in cells_with_similar_avail_values:
-                        for value in cell.available_values[self.solved_step]:
-                            if value in self.cells[row][cell.col].available_values[self.solved_step]:
-                                self.cells[row][cell.col].available_values[self.solved_step].remove(value)
-                                removed = True
-        return removed
-
-    def remove_non_avail_square_derived(self, cell):
-        """
-        Go over every cell in the square. For unsolved square, find other cells with
-        similar available values.
-        If the number of cell that share the same available values is the similar
-        to the amount of the available values that means that these cell hold
-        these values. For example if two cells in the square can have only 1,2
-        it is derived that 1,2 are in these two cells and are not available in
-        any other cells in the square.
-        """
-        removed = False
-        cells_with_similar_avail_values = []
-        for cell_in_square in cell.square_cells:
-            if cell.available_values[self.solved_step] == cell_in_square.available_values[self.solved_step]:
-                cells_with_similar_avail_values.append(cell_in_square)
-        if len(cells_with_similar_avail_values) == len(cell.available_values[self.solved_step]):
-            for cell_in_square in cell.square_cells:
-                if cell_in_square not in cells_with_similar_avail_values:
-                    for value in cell.available_values[self.solved_step]:
-                        if value in cell_in_square.available_values[self.solved_step]:
-                            cell_in_square.available_values[self.solved_step].remove(value)
-                            removed = True
-        return removed
-
-    def remove_non_available_values(self, cell, remove_type):
-        removed = False
-        if remove_type == "row":
-            row = cell.row
-            for col in range(9):
-                removed_value_from_cell = self.remove_non_available_value(cell, row, col, remove_type)
-                if removed_value_from_cell:
-                    removed = True
-
-        if remove_type == "col":
-            col = cell.col
-            for row in range(9):
-                removed_value_from_cell = self.remove_non_available_value(cell, row, col, remove_type)
-                if removed_value_from_cell:
-                    removed = True
-
-        if remove_type == "square":
-            for cell_in_square in cell.square_cells:
-                removed_value_from_cell = self.remove_non_available_value(cell, cell_in_square.row,
-                                                                          cell_in_square.col, remove_type)
-                if removed_value_from_cell:
-                    removed = True
-
-        if remove_type == "row_derived":
-            removed = self.remove_non_avail_row_derived(cell)
-
-        if remove_type == "col_derived":
-            removed = self.remove_non_avail_col_derived(cell)
-
-        if remove_type == "square_derived":
-            removed = self.remove_non_avail_square_derived(cell)
+        hidden_single = self.get_hidden_single(SQUARE_UNITS)
+        if hidden_single is not None:
+            cell, value = hidden_single
+            value_avail_in_row = cell.row
+            value_avail_in_col = cell.col
+            if self.hint:
+                self.hint = cell
+                self.msg = f"? is only available in cell ({value_avail_in_row + 1}" + \
+                    f",{value_avail_in_col + 1} in this square"
+            else:
+                self.solve_cell(cell, value)
 
-        return removed
+                self.msg = f"{value} is only available in cell ({value_avail_in_row+1}" + \
+                           f",{value_avail_in_col + 1} in this square"
+                if self.verbose > 2:
+                    print(f'solved step= {self.solved_step} ,{self.msg}')
+            rv = [value_avail_in_row, value_avail_in_col, value]
+        return rv
 
     def load_puzzle(self, a):
         if self.loaded:
@@ -962,8 +1666,38 @@ class Sudoku:
                 else:
                     cell.value = cell_input
                     cell.solved_step = 0
-                    cell.available_values.append({})
-        self.update_all_available_values(new_step=False)
+                    self.unsolved_cells -= 1
+        # Remove the values of the input cells from their peers at once. There is nothing to undo
+        # before the first step, so this is not recorded on the trail.
+        no_avail_cells = []
+        for cell in self.flat_cells:
+            if cell.value is None:
+                for index in PEERS[cell.index]:
+                    peer_value = self.flat_cells[index].value
+                    if peer_value is not None:
+                        cell.available_values &= ~(1 << peer_value)
+                if cell.available_values == 0:
+                    no_avail_cells.append(cell)
+        self.index_unit_values()
+        self.update_all_available_values()
+        if no_avail_cells:
+            self.set_not_solve_able(max(no_avail_cells, key=lambda c: (c.row, c.col)))
+
+
+# The board of a probe worker process, reused for all the probes the worker runs
+probe_sudoku = None
+
+
+def get_steps_to_stuck_in_worker(state, probes):
+    """
+    Run in a probe_executor process: load state and return get_steps_to_stuck of every (cell index, value) in probes.
+    """
+    global probe_sudoku
+    if probe_sudoku is None:
+        probe_sudoku = Sudoku(verbose=0)
+    probe_sudoku.load_state(state)
+    probe_sudoku.probe_cache.set_board(probe_sudoku.get_board_key())
+    return [probe_sudoku.get_steps_to_stuck(probe_sudoku.flat_cells[index], value) for index, value in probes]
 
 
 if __name__ == '__main__':
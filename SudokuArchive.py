@@ -0,0 +1,269 @@
+import argparse
+import array
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+import SudokuBatch
+import SudokuIO
+
+# A compact binary archive of puzzles, with O(1) access to puzzle number i, e.g.:
+#   python SudokuArchive.py convert corpus.sdka corpus.txt more.txt --names
+#   python SudokuArchive.py info corpus.sdka
+#   python SudokuArchive.py get corpus.sdka 0 1000000
+# SudokuBatch (and so SudokuRating, SudokuCache...) reads the archives (files ending with SUFFIX) as it
+# reads text files. With --workers, SudokuBatch.solve_parallel sends each pool worker only the range of
+# its chunk: the worker reads the puzzles from the file (see read_chunk), all the workers sharing the
+# pages of the memory map, instead of getting the puzzles pickled.
+#
+# The file holds a header (HEADER), then a record of RECORD_SIZE bytes per puzzle, then, when the names are
+# kept, the names: an offset (uint64) per puzzle plus the end offset, and all the names (utf-8) one after
+# the other. A record holds the 81 values, row by row, 4 bits each (0 for an empty cell): the first value
+# of each byte in the low 4 bits, the 81st value alone in the last byte.
+# Without names, the name of a puzzle is f'{archive file}:{number of the puzzle, from 1}'.
+
+SUFFIX = '.sdka'
+MAGIC = b'SDKA'
+VERSION = 1
+HEADER = struct.Struct('<4sHHQQ')  # Magic, version, record size, number of puzzles, offset of the names (0: none)
+RECORD_SIZE = 41
+# Per byte: the value of its low 4 bits, of its high 4 bits, and itself in the high 4 bits
+LOW_VALUES = bytes(byte & 15 for byte in range(256))
+HIGH_VALUES = bytes(byte >> 4 for byte in range(256))
+HIGH_CODES = bytes(byte << 4 & 255 for byte in range(256))
+CHAR_CODES = bytes.maketrans(SudokuIO.PUZZLE_CHARS, bytes([0] + list(range(10))))
+CODE_CHARS = bytes.maketrans(bytes(range(16)), b'.123456789abcdef')
+GRID_VALUES = (None,) + tuple(range(1, 16))
+
+
+def codes_to_record(codes):
+    """
+    The record of 81 bytes of values, 0 for an empty cell. The values are packed 2 at a time as integers.
+    """
+    codes += b'\0'
+    return (int.from_bytes(codes[0::2], 'little') |
+            int.from_bytes(codes[1::2].translate(HIGH_CODES), 'little')).to_bytes(RECORD_SIZE, 'little')
+
+
+def record_to_codes(record):
+    record = bytes(record)
+    codes = bytearray(RECORD_SIZE * 2)
+    codes[0::2] = record.translate(LOW_VALUES)
+    codes[1::2] = record.translate(HIGH_VALUES)
+    return codes[:81]
+
+
+def line_to_record(line):
+    """
+    The record of a puzzle line of 81 characters ('.' or '0' for an empty cell).
+    """
+    codes = line.encode('ascii')
+    if not SudokuIO.is_puzzle(codes):
+        raise ValueError(f'{line!r} is not a puzzle line')
+    return codes_to_record(codes.translate(CHAR_CODES))
+
+
+def grid_to_record(grid):
+    return codes_to_record(bytes([value or 0 for row in grid for value in row]))
+
+
+def record_to_line(record):
+    return record_to_codes(record).translate(CODE_CHARS).decode('ascii')
+
+
+def record_to_grid(record):
+    values = [GRID_VALUES[code] for code in record_to_codes(record)]
+    return [values[start:start + 9] for start in range(0, 81, 9)]
+
+
+class ArchiveWriter:
+    """
+    Write puzzles to a new archive, one at a time. The names, when kept, are spooled to a temporary file
+    until close, so memory stays flat whatever the number of puzzles.
+    """
+    def __init__(self, file_name, with_names=False):
+        self.output = open(file_name, 'wb')
+        self.output.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE, 0, 0))
+        self.count = 0
+        self.names = tempfile.TemporaryFile() if with_names else None
+        self.name_offsets = array.array('Q', [0])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, grid, name=None):
+        """
+        Add a puzzle: a grid (9 lists of 9 values, None for an empty cell) or an 81 characters line.
+        """
+        self.output.write(line_to_record(grid) if isinstance(grid, str) else grid_to_record(grid))
+        self.count += 1
+        if self.names is not None:
+            self.names.write(('' if name is None else name).encode())
+            self.name_offsets.append(self.names.tell())
+
+    def close(self):
+        names_offset = 0
+        if self.names is not None:
+            names_offset = self.output.tell()
+            self.output.write(self.name_offsets.tobytes())
+            self.names.seek(0)
+            shutil.copyfileobj(self.names, self.output)
+            self.names.close()
+        self.output.seek(0)
+        self.output.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE, self.count, names_offset))
+        self.output.close()
+
+
+class Archive:
+    """
+    An archive open for reading, through a memory map: archive[i] is the grid of puzzle number i.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        with open(file_name, 'rb') as archive_file:
+            self.map = mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.count, self.names_offset = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+            self.map.close()
+            raise ValueError(f'{file_name} is not a version {VERSION} sudoku archive')
+        self.records = memoryview(self.map)[HEADER.size:HEADER.size + self.count * RECORD_SIZE]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.records.release()
+        self.map.close()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return record_to_grid(self.get_record(index))
+
+    def get_record(self, index):
+        """
+        The record of puzzle number index, a memoryview of the map: no copy.
+        """
+        if not 0 <= index < self.count:
+            raise IndexError(f'puzzle {index} of {self.count}')
+        return self.records[index * RECORD_SIZE:(index + 1) * RECORD_SIZE]
+
+    def get_line(self, index):
+        return record_to_line(self.get_record(index))
+
+    def get_name(self, index):
+        if not self.names_offset:
+            return f'{self.file_name}:{index + 1}'
+        start, end = struct.unpack_from('<2Q', self.map, self.names_offset + index * 8)
+        names_start = self.names_offset + (self.count + 1) * 8
+        return self.map[names_start + start:names_start + end].decode()
+
+    def read(self, start=0, stop=None):
+        """
+        Yield (name, grid) for the puzzles number start to stop (default: the last).
+        """
+        stop = self.count if stop is None else min(stop, self.count)
+        for index in range(start, stop):
+            yield self.get_name(index), record_to_grid(self.records[index * RECORD_SIZE:(index + 1) * RECORD_SIZE])
+
+    def get_values(self, start=0, stop=None):
+        """
+        The values of the puzzles number start to stop (default: the last) as an (N, 9, 9) numpy array,
+        0 for an empty cell, e.g. for SudokuVector. The records are read in place from the map.
+        """
+        # Imported here, numpy is needed only for arrays
+        import numpy as np
+
+        stop = self.count if stop is None else min(stop, self.count)
+        records = np.frombuffer(self.map, dtype=np.uint8, count=(stop - start) * RECORD_SIZE,
+                                offset=HEADER.size + start * RECORD_SIZE).reshape(-1, RECORD_SIZE)
+        values = np.empty((len(records), RECORD_SIZE * 2), dtype=np.int8)
+        values[:, 0::2] = records & 15
+        values[:, 1::2] = records >> 4
+        return values[:, :81].reshape(-1, 9, 9)
+
+
+def read_puzzles(file_name):
+    """
+    Yield (name, grid) for every puzzle of the archive file_name.
+    """
+    with Archive(file_name) as archive:
+        yield from archive.read()
+
+
+def read_chunk(file_name, start, stop):
+    """
+    The list of (name, grid) of the puzzles number start to stop of the archive file_name, for a pool worker.
+    """
+    with Archive(file_name) as archive:
+        return list(archive.read(start, stop))
+
+
+def read_text_lines(file_name):
+    """
+    Yield (name, puzzle line) for every puzzle of the text file file_name, named as SudokuIO.read_puzzles
+    names them. The lines go to the archive without building their grids.
+    """
+    for line_number, line, _ in SudokuIO.read_lines(file_name):
+        yield f'{file_name}:{line_number}', line
+
+
+def convert(puzzles, file_name, with_names=False):
+    """
+    Write every (name, grid or puzzle line) of puzzles to the new archive file_name. Return the number of puzzles.
+    """
+    with ArchiveWriter(file_name, with_names) as writer:
+        for name, grid in puzzles:
+            writer.write(grid, name)
+        return writer.count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert sudoku puzzles to a binary archive, and read it.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert_parser = subparsers.add_parser('convert', help='write puzzles files to a new archive')
+    convert_parser.add_argument('archive_file', help=f'archive file to write, ending with {SUFFIX}')
+    convert_parser.add_argument('puzzles_files', nargs='*',
+                                help='81 characters lines (see SudokuIO.py), or python files of grids. ' +
+                                     'Default: the puzzles of SudokuPuzzles.py')
+    convert_parser.add_argument('-n', '--names', action='store_true', help='keep the names of the puzzles')
+    info_parser = subparsers.add_parser('info', help='print the number of puzzles of an archive')
+    info_parser.add_argument('archive_file')
+    get_parser = subparsers.add_parser('get', help='print puzzles of an archive, with their names')
+    get_parser.add_argument('archive_file')
+    get_parser.add_argument('indexes', type=int, nargs='+', help='numbers of the puzzles, from 0')
+    args = parser.parse_args(argv)
+
+    if args.command == 'convert':
+        if not args.archive_file.endswith(SUFFIX):
+            parser.error(f'the archive file must end with {SUFFIX}')
+        puzzles = (puzzle for puzzles_file in args.puzzles_files
+                   for puzzle in (SudokuBatch.read_puzzles(puzzles_file) if puzzles_file.endswith('.py') else
+                                  read_text_lines(puzzles_file))) \
+            if args.puzzles_files else SudokuBatch.read_sudoku_puzzles()
+        start = time.perf_counter()
+        count = convert(puzzles, args.archive_file, args.names)
+        seconds = time.perf_counter() - start
+        print(f'Puzzles: {count} ,bytes: {os.path.getsize(args.archive_file)} ,seconds: {seconds:.3f}', file=sys.stderr)
+        return
+    with Archive(args.archive_file) as archive:
+        if args.command == 'info':
+            print(f'Puzzles: {len(archive)} ,names: {"yes" if archive.names_offset else "no"}')
+        else:
+            for index in args.indexes:
+                print(f'{archive.get_line(index)} {archive.get_name(index)}')
+
+
+if __name__ == '__main__':
+    main()
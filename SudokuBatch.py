@@ -0,0 +1,306 @@
+import argparse
+import ast
+import collections
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import SudokuIO
+import SudokuPuzzles
+from Sudoku import Sudoku
+from SudokuIO import grid_to_line
+
+# Solve puzzles without a display, e.g.:
+#   python SudokuBatch.py puzzles.txt -o solutions.txt
+# puzzles.txt holds one puzzle per line: 81 characters, row by row, '.' or '0' for an empty cell, maybe with
+# other fields (see SudokuIO.py). It is read lazily, line by line.
+# A python file of SudokuPuzzles-style grids (name = [[...], ...]), or a binary archive (see SudokuArchive.py),
+# can be given instead.
+# With no file, all the puzzles in SudokuPuzzles.py are solved.
+# With --workers the puzzles are sent in chunks of --chunk-size to a pool of processes. From an archive, only
+# the range of each chunk is sent: the worker reads its puzzles from the file (see SudokuArchive.read_chunk).
+# With --probe-workers a single process solves the puzzles, sending the algo level 3 probes to a pool of processes.
+# With --eliminate algo level 3 removes all the values its probes find stuck, instead of solving one cell.
+# With --numpy the boards find their singles with the numpy engine of SudokuVector.py. Experimental: it
+# solves the same steps, slower than the default boards (about 1.5x), as numpy costs more per call than
+# the scans of Sudoku for a single board. The engine pays off on stacks of boards, see --batch.
+# With --batch each chunk of --chunk-size puzzles first gets all its singles set at once by SudokuVector.propagate.
+# Only the puzzles that need more are then solved step by step.
+
+
+class SolveResult:
+    def __init__(self, name, grid, solved, solve_able, steps, level3_steps, level4_steps, seconds):
+        self.name = name
+        self.grid = grid  # 9 lists of 9 values, None for cells that were not solved
+        self.solved = solved
+        self.solve_able = solve_able
+        self.steps = steps
+        self.level3_steps = level3_steps
+        self.level4_steps = level4_steps  # Cells set by search, after algo level 3 found nothing
+        self.seconds = seconds
+
+    def __str__(self):
+        return grid_to_line(self.grid)
+
+
+def solve(grid, name=None, sudoku=None, eliminate=False):
+    """
+    Solve grid (9 lists of 9 values, None for an empty cell) step by step, the same way
+    the right arrow, '3' and '4' keys do, until it is solved or found not solvable.
+    Once algo level 3 fails, the following steps that need more than algo level 2 go
+    straight to search.
+    With eliminate, algo level 3 is the 'e' key: remove the values found stuck.
+    sudoku, when given, is reset and reused instead of building a new board.
+    """
+    start = time.perf_counter()
+    if sudoku is None:
+        sudoku = Sudoku(verbose=0)
+    else:
+        sudoku.reset()
+    sudoku.load_puzzle(grid)
+    level3_steps = 0
+    level4_steps = 0
+    level3_failed = False
+    while sudoku.solve_able and not sudoku.solved:
+        if sudoku.solve_next_cell() is None:
+            if not level3_failed:
+                if eliminate:
+                    if sudoku.apply_algo_level3_eliminations():
+                        level3_steps += 1
+                        continue
+                else:
+                    solved_step = sudoku.solved_step
+                    sudoku.apply_algo_level3()
+                    if sudoku.solved_step != solved_step:
+                        level3_steps += 1
+                        continue
+                level3_failed = True
+            if sudoku.apply_algo_level4() is None:
+                break
+            level4_steps += 1
+
+    return SolveResult(name, [[cell.value for cell in row] for row in sudoku.cells], sudoku.solved,
+                       sudoku.solve_able, sudoku.solved_step, level3_steps, level4_steps,
+                       time.perf_counter() - start)
+
+
+def solve_batch(puzzles, sudoku=None, eliminate=False):
+    """
+    Solve a list of (name, grid) as solve() does, setting first the singles of all the puzzles
+    at once on numpy arrays. The puzzles solved that way are done. Those that got stuck go on
+    step by step from there, and those found not solvable are solved step by step from their
+    grid, so their result is the same as solve() gives.
+    The steps of a result count the singles set at once; its seconds include a share of the batch.
+    """
+    # Imported here, numpy is needed only for batches
+    import SudokuVector
+
+    start = time.perf_counter()
+    grids = [grid for _, grid in puzzles]
+    values, candidates = SudokuVector.grids_to_arrays(grids)
+    new_values, _, solved, contradicted = SudokuVector.propagate(values, candidates)
+    steps = ((new_values != 0).sum(axis=(-2, -1)) - (values != 0).sum(axis=(-2, -1))).tolist()
+    batch_seconds = (time.perf_counter() - start) / max(len(puzzles), 1)
+
+    results = []
+    for (name, grid), board_values, board_steps, board_solved, board_contradicted in \
+            zip(puzzles, new_values, steps, solved.tolist(), contradicted.tolist()):
+        if board_solved:
+            result = SolveResult(name, SudokuVector.arrays_to_grid(board_values), True, True, board_steps, 0, 0, 0)
+        elif board_contradicted:
+            result = solve(grid, name, sudoku, eliminate)
+        else:
+            result = solve(SudokuVector.arrays_to_grid(board_values), name, sudoku, eliminate)
+            result.steps += board_steps
+        result.seconds += batch_seconds
+        results.append(result)
+    return results
+
+
+def read_puzzles(file_name):
+    """
+    Yield (name, grid) for every puzzle in file_name, see the comment at the top of this file.
+    """
+    if file_name.endswith('.py'):
+        with open(file_name) as puzzles_file:
+            tree = ast.parse(puzzles_file.read())
+        for node in tree.body:
+            if isinstance(node, ast.Assign) and isinstance(node.value, ast.List):
+                yield node.targets[0].id, ast.literal_eval(node.value)
+        return
+    if file_name.endswith('.sdka'):
+        # Imported here, SudokuArchive imports this module
+        import SudokuArchive
+        yield from SudokuArchive.read_puzzles(file_name)
+        return
+    yield from SudokuIO.read_puzzles(file_name)
+
+
+def read_sudoku_puzzles():
+    for name, value in vars(SudokuPuzzles).items():
+        if not name.startswith('_') and isinstance(value, list):
+            yield name, value
+
+
+def get_board_class(use_numpy=False):
+    if use_numpy:
+        # Imported here, numpy is needed only by this option
+        from SudokuVector import VectorSudoku
+        return VectorSudoku
+    return Sudoku
+
+
+def get_chunks(puzzles, chunk_size):
+    puzzles = iter(puzzles)
+    return iter(lambda: list(itertools.islice(puzzles, chunk_size)), [])
+
+
+def solve_serial(puzzles, probe_executor=None, eliminate=False, use_numpy=False, batch_size=None):
+    """
+    Solve puzzles in this process, one by one, or batch_size at a time with solve_batch.
+    """
+    sudoku = get_board_class(use_numpy)(verbose=0)
+    sudoku.probe_executor = probe_executor
+    if batch_size:
+        for chunk in get_chunks(puzzles, batch_size):
+            yield from solve_batch(chunk, sudoku, eliminate)
+        return
+    for name, grid in puzzles:
+        yield solve(grid, name, sudoku, eliminate)
+
+
+# The board of a pool worker, reused for all the puzzles the worker solves
+worker_sudoku = None
+
+
+def init_worker(use_numpy=False):
+    global worker_sudoku
+    worker_sudoku = get_board_class(use_numpy)(verbose=0)
+
+
+def solve_chunk(chunk, eliminate=False, batch=False):
+    """
+    Solve chunk, a list of (name, grid), or an (archive file name, start, stop) range of puzzles to read.
+    """
+    if isinstance(chunk, tuple):
+        # Imported here, SudokuArchive imports this module
+        import SudokuArchive
+        chunk = SudokuArchive.read_chunk(*chunk)
+    if batch:
+        return solve_batch(chunk, worker_sudoku, eliminate)
+    return [solve(grid, name, worker_sudoku, eliminate) for name, grid in chunk]
+
+
+def solve_parallel(puzzles, workers=None, chunk_size=64, ordered=True, eliminate=False, use_numpy=False,
+                   batch=False):
+    """
+    Solve puzzles on a pool of worker processes (default: one per core), chunk_size puzzles
+    per task, each task solved as a batch when batch is True. Yield the results in the order
+    of puzzles, or as soon as each chunk is done when ordered is False.
+    Only a few chunks per worker are read ahead, so puzzles may be a stream of any length.
+    puzzles may also be the file name of an archive (see SudokuArchive.py): the workers then read their
+    chunks from the file, only the ranges are sent to them.
+    """
+    workers = workers or os.cpu_count()
+    if isinstance(puzzles, str):
+        # Imported here, SudokuArchive imports this module
+        import SudokuArchive
+        with SudokuArchive.Archive(puzzles) as archive:
+            count = len(archive)
+        chunks = ((puzzles, start, start + chunk_size) for start in range(0, count, chunk_size))
+    else:
+        chunks = get_chunks(puzzles, chunk_size)
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(use_numpy,)) as executor:
+        pending = collections.deque(executor.submit(solve_chunk, chunk, eliminate, batch)
+                                    for chunk in itertools.islice(chunks, workers * 2))
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+            for future in done:
+                yield from future.result()
+                for chunk in itertools.islice(chunks, 1):
+                    pending.append(executor.submit(solve_chunk, chunk, eliminate, batch))
+
+
+def solve_all(results, output, quiet=False, with_names=False):
+    """
+    Write one solution line per result to output (prefixed by the puzzle name when with_names)
+    and print the stats to stderr.
+    """
+    count = 0
+    solved = 0
+    level3_steps = 0
+    level4_steps = 0
+    start = time.perf_counter()
+    for result in results:
+        name = result.name
+        count += 1
+        solved += result.solved
+        level3_steps += result.level3_steps
+        level4_steps += result.level4_steps
+        output.write(f'{name} {result}\n' if with_names else f'{result}\n')
+        if not quiet:
+            print(f'{name}: solved= {result.solved} ,steps= {result.steps} ,level3 steps= {result.level3_steps} ,' +
+                  f'level4 steps= {result.level4_steps} ,{result.seconds * 1000:.1f} ms', file=sys.stderr)
+
+    seconds = time.perf_counter() - start
+    print(f'Puzzles: {count} ,solved: {solved} ,level3 steps: {level3_steps} ,level4 steps: {level4_steps} ,' +
+          f'seconds: {seconds:.3f} ,' +
+          f'puzzles per second: {count / seconds if seconds else 0:.1f}', file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Solve sudoku puzzles without a display.')
+    parser.add_argument('puzzles_file', nargs='?',
+                        help='one 81 characters puzzle per line, or a python file of grids. ' +
+                             'Default: the puzzles of SudokuPuzzles.py')
+    parser.add_argument('-o', '--output', help='solutions file, default: stdout')
+    parser.add_argument('-q', '--quiet', action='store_true', help='print only the total stats')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of processes, 0 for one per core. Default: 1, solve in this process')
+    parser.add_argument('-c', '--chunk-size', type=int, default=64,
+                        help='puzzles per task sent to a worker, or per batch')
+    parser.add_argument('-u', '--unordered', action='store_true',
+                        help='write each chunk as soon as it is solved, prefixed by the puzzle name')
+    parser.add_argument('-p', '--probe-workers', type=int, default=1,
+                        help='number of processes running the algo level 3 probes, 0 for one per core. ' +
+                             'Only with --workers 1. Default: 1, probe in this process')
+    parser.add_argument('-e', '--eliminate', action='store_true',
+                        help='algo level 3 removes all the values its probes find stuck, instead of solving one cell')
+    parser.add_argument('-n', '--numpy', action='store_true',
+                        help='experimental, slower: find the singles with the numpy engine of single boards')
+    parser.add_argument('-b', '--batch', action='store_true',
+                        help='set the singles of each chunk of puzzles at once with numpy, then solve step by step ' +
+                             'only the puzzles that need more')
+    args = parser.parse_args(argv)
+    if args.probe_workers != 1 and args.workers != 1:
+        parser.error('--probe-workers needs --workers 1')
+
+    puzzles = read_puzzles(args.puzzles_file) if args.puzzles_file else read_sudoku_puzzles()
+    probe_executor = None
+    if args.probe_workers != 1:
+        probe_executor = ProcessPoolExecutor(args.probe_workers or os.cpu_count())
+    if args.workers != 1 and args.puzzles_file and args.puzzles_file.endswith('.sdka'):
+        puzzles = args.puzzles_file  # The workers read their chunks from the archive
+    if args.workers == 1:
+        results = solve_serial(puzzles, probe_executor, args.eliminate, args.numpy,
+                               args.chunk_size if args.batch else None)
+    else:
+        results = solve_parallel(puzzles, args.workers, args.chunk_size, not args.unordered, args.eliminate,
+                                 args.numpy, args.batch)
+    try:
+        with SudokuIO.LineWriter(args.output) as output:
+            solve_all(results, output, args.quiet, args.unordered)
+    finally:
+        if probe_executor is not None:
+            probe_executor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
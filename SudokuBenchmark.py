@@ -0,0 +1,272 @@
+import argparse
+import hashlib
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import SudokuBatch
+import SudokuGenerator
+import SudokuRating
+from Sudoku import Sudoku, count_solutions
+from SudokuIO import grid_to_line, line_to_grid
+
+# Benchmark the step by step solver (SudokuBatch.solve) on tiers of puzzles, without a display, e.g.:
+#   python SudokuBenchmark.py -o baseline.json
+#   python SudokuBenchmark.py -b baseline.json -o results.json
+# The default tiers are the puzzles of SudokuPuzzles.py, 'easy' (algo level 1) and 'hard' (algo level 3 or 4)
+# puzzles generated by SudokuGenerator from GENERATED_SEED, and the 17 clues puzzles of SEVENTEEN_CLUES.
+# --tier adds a tier read from a file, as SudokuBatch reads it (e.g. a larger corpus).
+# Per tier: the puzzles per second, the percentiles of the time per puzzle, the time of each call of the
+# TIMED_STEPS (only the steps of the solve loop, not those the steps make, e.g. the probes of algo level 3)
+# and of update_all_available_values (all its calls), and the peak of the memory allocated while solving
+# (tracemalloc, in a separate run so the timings are not slowed down by it).
+# Each tier is solved --repeat times, the fastest run is kept.
+# The results are saved as JSON. With --baseline, they are compared to a saved run. These are regressions,
+# and make the exit status 1: a time (or the memory) more than --tolerance above the baseline, puzzles per
+# second more than --tolerance below it, or any fewer puzzles solved. Within --tolerance, a change is taken
+# for the noise of the timings. Puzzles that differ from the baseline (see 'digest') are reported.
+
+TIMED_STEPS = ('solve_next_cell', 'apply_algo_level3', 'apply_algo_level3_eliminations', 'apply_algo_level4')
+GENERATED_SEED = 'benchmark'
+GENERATED_LEVELS = {'easy': (1,), 'hard': (3, 4)}
+SEVENTEEN_CLUES = (
+    '000000010400000000020000000000050407008000300001090000300400200050100000000806000',
+    '000000010400000000020000000000050604008000300001090000300400200050100000000807000',
+    '000000012000035000000600070700000300000400800100000000000120000080000040050000600',
+    '000000012003600000000007000410020000000500300700000600280000040000300500000000000',
+    '000000012008030000000000040120500000000004700060000000507000300000620000000100000',
+    '000000012040050000000009000070600400000100000000000050000087500601000300200000000',
+    '000000012050400000000000030700600400001000000000080000920000800000510700000003000',
+    '000000012300000060000040000900000500000001070020000000000350400001400800060000000',
+    '000000012400090000000000050070200000600000400000108000018000000000030700502000000',
+    '000000012500008000000700000600120000700000450000030000030000800000500700020000000',
+)
+PERCENTILES = (50, 90, 99, 100)
+
+
+class TimedSudoku(Sudoku):
+    """
+    A Sudoku board that times its steps, for the benchmark. The timing is here only, so Sudoku is not
+    slowed down by it.
+    """
+    def __init__(self, verbose=0):
+        self.timings = {name: [0, 0.0] for name in TIMED_STEPS + ('update_all_available_values',)}
+        self.timed_step = None  # The name of the step running, None between steps
+        self.updating = False
+        super().__init__(verbose)
+
+    def time_step(self, name, step):
+        if self.timed_step is not None:
+            return step()
+        self.timed_step = name
+        start = time.perf_counter()
+        try:
+            return step()
+        finally:
+            timing = self.timings[name]
+            timing[0] += 1
+            timing[1] += time.perf_counter() - start
+            self.timed_step = None
+
+    def solve_next_cell(self):
+        return self.time_step('solve_next_cell', super().solve_next_cell)
+
+    def apply_algo_level3(self):
+        return self.time_step('apply_algo_level3', super().apply_algo_level3)
+
+    def apply_algo_level3_eliminations(self):
+        return self.time_step('apply_algo_level3_eliminations', super().apply_algo_level3_eliminations)
+
+    def apply_algo_level4(self):
+        return self.time_step('apply_algo_level4', super().apply_algo_level4)
+
+    def update_all_available_values(self):
+        if self.updating:
+            return super().update_all_available_values()
+        self.updating = True
+        start = time.perf_counter()
+        try:
+            return super().update_all_available_values()
+        finally:
+            timing = self.timings['update_all_available_values']
+            timing[0] += 1
+            timing[1] += time.perf_counter() - start
+            self.updating = False
+
+
+def get_generated_tiers(count, seed=GENERATED_SEED):
+    """
+    The {tier name: list of (name, grid)} of count puzzles per tier of GENERATED_LEVELS, generated from seed.
+    """
+    tiers = {tier: [] for tier in GENERATED_LEVELS}
+    for rating in SudokuGenerator.generate_all(seed):
+        level = SudokuRating.get_level(rating)
+        for tier, levels in GENERATED_LEVELS.items():
+            if level in levels and len(tiers[tier]) < count:
+                tiers[tier].append((rating.name, rating.grid))
+        if all(len(puzzles) >= count for puzzles in tiers.values()):
+            return tiers
+
+
+def get_seventeen_clues_tier():
+    """
+    The list of (name, grid) of SEVENTEEN_CLUES, each checked to have 17 clues and a single solution.
+    """
+    puzzles = []
+    for index, line in enumerate(SEVENTEEN_CLUES):
+        grid = line_to_grid(line)
+        clues = sum(value is not None for row in grid for value in row)
+        if clues != 17 or count_solutions(grid) != 1:
+            raise ValueError(f'SEVENTEEN_CLUES {line} has {clues} clues, or not a single solution')
+        puzzles.append((f'17_clues:{index + 1}', grid))
+    return puzzles
+
+
+def get_percentile(sorted_values, percent):
+    return sorted_values[min(len(sorted_values) - 1, len(sorted_values) * percent // 100)]
+
+
+def get_peak_memory(puzzles, eliminate=False):
+    """
+    The peak, in KB, of the memory allocated while solving puzzles on a new board.
+    """
+    tracemalloc.start()
+    try:
+        sudoku = Sudoku(verbose=0)
+        for name, grid in puzzles:
+            SudokuBatch.solve(grid, name, sudoku, eliminate)
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+
+def run_tier(puzzles, repeat=3, eliminate=False, memory=True):
+    """
+    The results of solving the list of (name, grid) puzzles, see the comment at the top of this file.
+    """
+    best = None
+    for _ in range(repeat):
+        sudoku = TimedSudoku()
+        start = time.perf_counter()
+        results = [SudokuBatch.solve(grid, name, sudoku, eliminate) for name, grid in puzzles]
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best[0]:
+            best = seconds, results, sudoku.timings
+    seconds, results, timings = best
+
+    latencies = sorted(result.seconds * 1000 for result in results)
+    lines = '\n'.join(grid_to_line(grid) for _, grid in puzzles)
+    return {
+        'puzzles': len(puzzles),
+        'digest': hashlib.sha1(lines.encode()).hexdigest(),
+        'solved': sum(result.solved for result in results),
+        'seconds': round(seconds, 6),
+        'puzzles_per_second': round(len(puzzles) / seconds if seconds else 0, 3),
+        'latency_ms': {f'p{percent}': round(get_percentile(latencies, percent), 4) for percent in PERCENTILES},
+        'steps': {name: {'calls': calls, 'seconds': round(step_seconds, 6),
+                         'us_per_call': round(step_seconds / calls * 1e6 if calls else 0, 3)}
+                  for name, (calls, step_seconds) in timings.items()},
+        'peak_memory_kb': get_peak_memory(puzzles, eliminate) if memory else None,
+    }
+
+
+def get_metrics(tier_results):
+    """
+    Yield (metric name, value, True when higher is better) of the results of a tier.
+    """
+    yield 'solved', tier_results['solved'], True
+    yield 'puzzles_per_second', tier_results['puzzles_per_second'], True
+    for percentile, value in tier_results['latency_ms'].items():
+        yield f'latency_ms {percentile}', value, False
+    for name, step in tier_results['steps'].items():
+        yield f'{name} us_per_call', step['us_per_call'], False
+    yield 'peak_memory_kb', tier_results['peak_memory_kb'], False
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Print to stderr how results compare to baseline, tier by tier. Return the number of regressions:
+    the metrics that got worse by more than tolerance (a share of the baseline), and any drop of solved.
+    """
+    regressions = 0
+    for tier, tier_results in results['tiers'].items():
+        base_results = baseline['tiers'].get(tier)
+        if base_results is None:
+            print(f'{tier}: not in the baseline', file=sys.stderr)
+            continue
+        if base_results['digest'] != tier_results['digest']:
+            print(f'{tier}: the puzzles differ from the baseline', file=sys.stderr)
+        base_metrics = {name: value for name, value, _ in get_metrics(base_results)}
+        for name, value, higher_is_better in get_metrics(tier_results):
+            base_value = base_metrics.get(name)
+            if not base_value or value is None:
+                continue
+            change = value / base_value - 1
+            if name == 'solved':
+                regressed = value < base_value
+            else:
+                regressed = change < -tolerance if higher_is_better else change > tolerance
+            regressions += regressed
+            print(f'{tier} {name}: {base_value} -> {value} ,{change:+.1%}{" REGRESSION" if regressed else ""}',
+                  file=sys.stderr)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the sudoku solver and compare to a baseline.')
+    parser.add_argument('-t', '--tier', action='append', default=[], metavar='NAME=FILE',
+                        help='add a tier of the puzzles of FILE, read as SudokuBatch reads it')
+    parser.add_argument('-n', '--generated', type=int, default=20, help='puzzles per generated tier, 0 for none')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs per tier, the fastest is kept')
+    parser.add_argument('-e', '--eliminate', action='store_true',
+                        help='algo level 3 removes all the values its probes find stuck, instead of solving one cell')
+    parser.add_argument('-m', '--no-memory', action='store_true', help='do not measure the peak memory')
+    parser.add_argument('-o', '--output', help='results JSON file, default: stdout')
+    parser.add_argument('-b', '--baseline', help='results JSON file to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='share of the baseline a time, the memory or the puzzles per second may get worse by ' +
+                             'before it is a regression. Default: 0.2, 20%%')
+    args = parser.parse_args(argv)
+
+    tiers = {'sudoku_puzzles': list(SudokuBatch.read_sudoku_puzzles())}
+    if args.generated:
+        tiers.update(get_generated_tiers(args.generated))
+    tiers['17_clues'] = get_seventeen_clues_tier()
+    for tier in args.tier:
+        name, _, file_name = tier.partition('=')
+        if not file_name:
+            parser.error(f'--tier {tier}: expected NAME=FILE')
+        tiers[name] = list(SudokuBatch.read_puzzles(file_name))
+
+    results = {'python': platform.python_version(), 'platform': platform.platform(),
+               'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'eliminate': args.eliminate, 'tiers': {}}
+    for name, puzzles in tiers.items():
+        tier_results = run_tier(puzzles, args.repeat, args.eliminate, not args.no_memory)
+        results['tiers'][name] = tier_results
+        print(f'{name}: Puzzles: {tier_results["puzzles"]} ,solved: {tier_results["solved"]} ,' +
+              f'puzzles per second: {tier_results["puzzles_per_second"]:.1f} ,' +
+              f'p50 ms: {tier_results["latency_ms"]["p50"]:.3f} ,p99 ms: {tier_results["latency_ms"]["p99"]:.3f} ,' +
+              f'peak memory KB: {tier_results["peak_memory_kb"]}', file=sys.stderr)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as results_file:
+            results_file.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['eliminate'] != args.eliminate:
+            parser.error(f'{args.baseline} was run with eliminate= {baseline["eliminate"]}')
+        regressions = compare(results, baseline, args.tolerance)
+        print(f'Regressions: {regressions}', file=sys.stderr)
+        if regressions:
+            parser.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+
+import SudokuBatch
+import SudokuIO
+from Sudoku import Sudoku
+from SudokuSymmetry import get_canonical_form
+
+# A cache of solutions and step logs in front of SudokuBatch.solve, e.g.:
+#   python SudokuCache.py puzzles.txt -o solutions.txt --cache-file solutions.json
+# The entries are keyed by the canonical form of the puzzle (see SudokuSymmetry.py), so a puzzle that
+# was solved before, in any orientation or with its values relabelled, is answered without solving it:
+# the cached solution and step log are mapped back to the puzzle with its Transform.
+# On a miss the puzzle is solved in its canonical orientation, so all the transforms of a puzzle get the
+# same answer, whichever came first. Its steps may differ from solving the puzzle as given.
+# With --exact the key is the 81 characters line of the puzzle: only the exact repeats are answered,
+# without the cost of the canonical form.
+# The puzzles already seen keep their key and Transform, so an exact repeat costs a dict lookup either way.
+# The least recently used entries are dropped beyond --size. With --cache-file the entries are loaded
+# from the file when it exists, and saved to it at the end.
+
+
+class CachedSolveResult(SudokuBatch.SolveResult):
+    def __init__(self, name, grid, solved, solve_able, steps, level3_steps, level4_steps, seconds, step_log,
+                 cached):
+        super().__init__(name, grid, solved, solve_able, steps, level3_steps, level4_steps, seconds)
+        self.step_log = step_log  # (row, col, value) of each cell solved, in order
+        self.cached = cached  # True when answered from the cache
+
+
+class CacheEntry:
+    def __init__(self, grid, solved, solve_able, steps, level3_steps, level4_steps, step_log):
+        # The result of solving the puzzle in the orientation of its key
+        self.grid = grid
+        self.solved = solved
+        self.solve_able = solve_able
+        self.steps = steps
+        self.level3_steps = level3_steps
+        self.level4_steps = level4_steps
+        self.step_log = step_log
+
+    def to_json(self):
+        return [SudokuIO.grid_to_line(self.grid), self.solved, self.solve_able, self.steps, self.level3_steps,
+                self.level4_steps, self.step_log]
+
+    @classmethod
+    def from_json(cls, values):
+        line, solved, solve_able, steps, level3_steps, level4_steps, step_log = values
+        return cls(SudokuIO.line_to_grid(line), solved, solve_able, steps, level3_steps, level4_steps,
+                   [tuple(step) for step in step_log])
+
+
+class SolutionCache:
+    def __init__(self, max_size=10000, exact=False, eliminate=False, file_name=None):
+        self.max_size = max_size
+        self.exact = exact
+        self.eliminate = eliminate  # Solve with algo level 3 eliminations, see SudokuBatch.solve
+        self.file_name = file_name
+        self.entries = collections.OrderedDict()  # key: CacheEntry, least recently used first
+        self.keys = collections.OrderedDict()  # puzzle line: (key, Transform to the key orientation or None)
+        self.sudoku = Sudoku(verbose=0)
+        self.hits = 0
+        self.misses = 0
+        if file_name is not None and os.path.exists(file_name):
+            self.load()
+
+    def get_key(self, grid):
+        """
+        The (key, Transform from grid to the orientation of the key, None for an exact key) of grid.
+        """
+        line = SudokuIO.grid_to_line(grid)
+        key_transform = self.keys.get(line)
+        if key_transform is not None:
+            self.keys.move_to_end(line)
+            return key_transform
+        try:
+            key_transform = (line, None) if self.exact else get_canonical_form(grid)
+        except ValueError:
+            # A grid that repeats a value has no canonical form, only its exact key
+            key_transform = line, None
+        self.keys[line] = key_transform
+        if len(self.keys) > self.max_size:
+            self.keys.popitem(last=False)
+        return key_transform
+
+    def solve(self, grid, name=None):
+        """
+        The CachedSolveResult of grid (9 lists of 9 values, None for an empty cell), from the cache
+        when the puzzle or a transform of it was solved before.
+        """
+        start = time.perf_counter()
+        key, transform = self.get_key(grid)
+        entry = self.entries.get(key)
+        cached = entry is not None
+        if cached:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        else:
+            self.misses += 1
+            result = SudokuBatch.solve(grid if transform is None else transform.apply(grid), name, self.sudoku,
+                                       self.eliminate)
+            entry = CacheEntry(result.grid, result.solved, result.solve_able, result.steps, result.level3_steps,
+                               result.level4_steps,
+                               [(cell.row, cell.col, cell.value) for _, cell in self.sudoku.steps])
+            self.entries[key] = entry
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+        result_grid = entry.grid
+        step_log = entry.step_log
+        if transform is not None:
+            result_grid = transform.invert(result_grid)
+            step_log = [transform.invert_cell(row, col, value) for row, col, value in step_log]
+        return CachedSolveResult(name, result_grid, entry.solved, entry.solve_able, entry.steps, entry.level3_steps,
+                                 entry.level4_steps, time.perf_counter() - start, step_log, cached)
+
+    def load(self):
+        with open(self.file_name) as cache_file:
+            data = json.load(cache_file)
+        if data['exact'] != self.exact or data['eliminate'] != self.eliminate:
+            raise ValueError(f"{self.file_name} was saved with exact= {data['exact']} ,eliminate= {data['eliminate']}")
+        for key, values in data['entries'][-self.max_size:]:
+            self.entries[key] = CacheEntry.from_json(values)
+
+    def save(self):
+        """
+        Write the entries to the cache file, least recently used first. The file is replaced at
+        once, so an interrupted save keeps the previous file.
+        """
+        data = {'exact': self.exact, 'eliminate': self.eliminate,
+                'entries': [[key, entry.to_json()] for key, entry in self.entries.items()]}
+        temp_file_name = f'{self.file_name}.tmp'
+        with open(temp_file_name, 'w') as cache_file:
+            json.dump(data, cache_file)
+        os.replace(temp_file_name, self.file_name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Solve sudoku puzzles through a cache of solutions.')
+    parser.add_argument('puzzles_file', nargs='?',
+                        help='one 81 characters puzzle per line, or a python file of grids. ' +
+                             'Default: the puzzles of SudokuPuzzles.py')
+    parser.add_argument('-o', '--output', help='solutions file, default: stdout')
+    parser.add_argument('-q', '--quiet', action='store_true', help='print only the total stats')
+    parser.add_argument('-f', '--cache-file', help='load the cache from this file when it exists, and save it to it')
+    parser.add_argument('-s', '--size', type=int, default=10000, help='most puzzles kept in the cache')
+    parser.add_argument('-x', '--exact', action='store_true',
+                        help='key the cache by the puzzle line instead of its canonical form')
+    parser.add_argument('-e', '--eliminate', action='store_true',
+                        help='algo level 3 removes all the values its probes find stuck, instead of solving one cell')
+    args = parser.parse_args(argv)
+
+    puzzles = SudokuBatch.read_puzzles(args.puzzles_file) if args.puzzles_file else SudokuBatch.read_sudoku_puzzles()
+    cache = SolutionCache(args.size, args.exact, args.eliminate, args.cache_file)
+    results = (cache.solve(grid, name) for name, grid in puzzles)
+    with SudokuIO.LineWriter(args.output) as output:
+        SudokuBatch.solve_all(results, output, args.quiet)
+    print(f'Cache hits: {cache.hits} ,misses: {cache.misses} ,entries: {len(cache.entries)}', file=sys.stderr)
+    if args.cache_file:
+        cache.save()
+
+
+if __name__ == '__main__':
+    main()
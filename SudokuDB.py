@@ -0,0 +1,173 @@
+import argparse
+import itertools
+import sqlite3
+import sys
+import time
+
+import SudokuBatch
+import SudokuIO
+from Sudoku import count_solutions
+from SudokuSymmetry import get_canonical_form
+
+# Store puzzles in a local SQLite database, keyed on their canonical form (see SudokuSymmetry.py), e.g.:
+#   python SudokuDB.py puzzles.db add puzzles.txt
+#   python SudokuDB.py puzzles.db duplicates
+#   python SudokuDB.py puzzles.db find ..3...6.1.45.13..8...74.......8...32..2...8..68...2.......71...3..42.79.7.6...1..
+# The puzzles are read as SudokuBatch reads them, with no file: the puzzles of SudokuPuzzles.py.
+# A puzzle and all its transforms (duplicates, and isomorphic puzzles: the same puzzle with its rows, cols
+# or values swapped) have the same canonical form, so they are found by a single lookup in its index.
+# With add --unique only the puzzles with exactly one solution are stored. The others are reported as Not
+# unique, or as Undecided when count_solutions gave up on them (too many branches to tell).
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS puzzles (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    puzzle TEXT NOT NULL,
+    canonical TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS puzzles_canonical ON puzzles (canonical);
+"""
+
+
+class PuzzleDB:
+    def __init__(self, file_name=':memory:'):
+        self.connection = sqlite3.connect(file_name)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM puzzles').fetchone()[0]
+
+    def add(self, name, grid):
+        """
+        Store the puzzle grid (9 lists of 9 values, None for an empty cell). Return its canonical form.
+        """
+        return self.add_all([(name, grid)])[0]
+
+    def add_all(self, puzzles, chunk_size=1000, invalid=None):
+        """
+        Store every (name, grid) of puzzles, chunk_size puzzles per transaction.
+        Return the canonical forms of the stored puzzles. A grid that repeats a value in a row, col or
+        square has no canonical form: it is not stored but appended to invalid, or raises ValueError
+        when invalid is None.
+        """
+        canonicals = []
+        for chunk in SudokuBatch.get_chunks(puzzles, chunk_size):
+            rows = []
+            for name, grid in chunk:
+                try:
+                    rows.append((name, SudokuIO.grid_to_line(grid), get_canonical_form(grid)[0]))
+                except ValueError:
+                    if invalid is None:
+                        raise
+                    invalid.append((name, grid))
+            with self.connection:
+                self.connection.executemany('INSERT INTO puzzles (name, puzzle, canonical) VALUES (?, ?, ?)', rows)
+            canonicals += [canonical for _, _, canonical in rows]
+        return canonicals
+
+    def find_canonical(self, canonical):
+        """
+        The (name, puzzle line) of the stored puzzles with the canonical form canonical, in the order they were added.
+        """
+        return self.connection.execute('SELECT name, puzzle FROM puzzles WHERE canonical = ? ORDER BY id',
+                                       (canonical,)).fetchall()
+
+    def find(self, grid):
+        """
+        The (name, puzzle line) of the stored puzzles that are grid or a transform of it.
+        """
+        return self.find_canonical(get_canonical_form(grid)[0])
+
+    def get_duplicates(self):
+        """
+        Yield (canonical form, list of (name, puzzle line)) for every canonical form of more than one
+        stored puzzle.
+        """
+        cursor = self.connection.execute(
+            'SELECT canonical, name, puzzle FROM puzzles WHERE canonical IN '
+            '(SELECT canonical FROM puzzles GROUP BY canonical HAVING COUNT(*) > 1) ORDER BY canonical, id')
+        for canonical, rows in itertools.groupby(cursor, key=lambda row: row[0]):
+            yield canonical, [(name, puzzle) for _, name, puzzle in rows]
+
+
+def get_unique_puzzles(puzzles, rejected, undecided):
+    """
+    Yield the (name, grid) of puzzles that have exactly one solution, appending the others to rejected,
+    and to undecided those count_solutions gave up on (too many branches to tell).
+    """
+    for name, grid in puzzles:
+        solutions = count_solutions(grid)
+        if solutions == 1:
+            yield name, grid
+        elif solutions is None:
+            undecided.append((name, grid))
+        else:
+            rejected.append((name, grid))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Store sudoku puzzles and find duplicate and isomorphic ones.')
+    parser.add_argument('db_file', help='SQLite database file, created when missing')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    add_parser = subparsers.add_parser('add', help='store puzzles')
+    add_parser.add_argument('puzzles_file', nargs='?',
+                            help='one 81 characters puzzle per line, or a python file of grids. ' +
+                                 'Default: the puzzles of SudokuPuzzles.py')
+    add_parser.add_argument('-u', '--unique', action='store_true',
+                            help='store only the puzzles with exactly one solution')
+    find_parser = subparsers.add_parser('find', help='print the stored puzzles isomorphic to a puzzle')
+    find_parser.add_argument('puzzle', help='81 characters puzzle')
+    subparsers.add_parser('duplicates', help='print the groups of stored puzzles isomorphic to each other')
+    args = parser.parse_args(argv)
+
+    with PuzzleDB(args.db_file) as puzzle_db:
+        if args.command == 'add':
+            puzzles = SudokuBatch.read_puzzles(args.puzzles_file) if args.puzzles_file else \
+                SudokuBatch.read_sudoku_puzzles()
+            rejected = []
+            undecided = []
+            if args.unique:
+                puzzles = get_unique_puzzles(puzzles, rejected, undecided)
+            invalid = []
+            start = time.perf_counter()
+            added = len(puzzle_db.add_all(puzzles, invalid=invalid))
+            seconds = time.perf_counter() - start
+            for name, grid in rejected:
+                print(f'Not unique: {SudokuIO.grid_to_line(grid)} {name}', file=sys.stderr)
+            for name, grid in undecided:
+                print(f'Undecided: {SudokuIO.grid_to_line(grid)} {name}', file=sys.stderr)
+            for name, grid in invalid:
+                print(f'Invalid: {SudokuIO.grid_to_line(grid)} {name}', file=sys.stderr)
+            count = added + len(rejected) + len(undecided) + len(invalid)
+            print(f'Puzzles: {count}, added: {added}, stored: {len(puzzle_db)}, ' +
+                  f'seconds: {seconds:.3f}, puzzles per second: {count / seconds if seconds else 0:.1f}',
+                  file=sys.stderr)
+        elif args.command == 'find':
+            try:
+                found = puzzle_db.find(SudokuIO.line_to_grid(args.puzzle))
+            except ValueError as error:
+                parser.error(f'{args.puzzle}: {error}')
+            for name, puzzle in found:
+                print(f'{puzzle} {name}')
+        else:
+            groups = 0
+            for canonical, rows in puzzle_db.get_duplicates():
+                groups += 1
+                print(canonical)
+                for name, puzzle in rows:
+                    print(f'  {puzzle} {name}')
+            print(f'Groups of duplicates: {groups}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
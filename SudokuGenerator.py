@@ -0,0 +1,145 @@
+import argparse
+import collections
+import itertools
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import SudokuRating
+from Sudoku import ALL_VALUES, SQUARE_UNITS, assign_value, count_solutions, search_solutions
+
+# Generate puzzles at a target difficulty, e.g.:
+#   python SudokuGenerator.py -n 20 -l 2 3 -w 0 -s 7 -o puzzles.txt
+# Each puzzle starts from a random full grid: the 3 squares of the diagonal filled at random (they do not
+# share a row or col, so any fill is valid) and the rest by search. Clues are then removed in random order,
+# a group of symmetric cells at a time (--symmetry), putting back those that leave the puzzle without a
+# single solution (see count_solutions). The puzzle is rated by SudokuRating: its level is the hardest
+# algo level it needs, 1 for singles only, 2, 3 (lssfc) or 4 (search), see SudokuRating.get_level.
+# Puzzle number index of seed is generated by random.Random(f'{seed}:{index}'), so the puzzles are the same
+# whatever the number of workers. They are written as they are generated, in order, those at the
+# target levels only. The puzzles per minute of each level are printed to stderr.
+
+# For each symmetry, the groups of cells that are removed together
+SYMMETRY_CELLS = {
+    'none': tuple((index,) for index in range(81)),
+    'rotational': tuple(sorted({tuple(sorted({index, 80 - index})) for index in range(81)})),
+    'mirror': tuple(sorted({tuple(sorted({index, index // 9 * 9 + 8 - index % 9})) for index in range(81)})),
+    'diagonal': tuple(sorted({tuple(sorted({index, index % 9 * 9 + index // 9})) for index in range(81)})),
+}
+
+
+def get_full_grid(rng):
+    """
+    A random full grid, 9 lists of 9 values.
+    """
+    values = [None] * 81
+    available_values = [ALL_VALUES] * 81
+    for square in (0, 4, 8):
+        for index, value in zip(SQUARE_UNITS[square], rng.sample(range(1, 10), 9)):
+            assign_value(values, available_values, index, value)
+    solutions = []
+    search_solutions(values, available_values, solutions, 1)
+    return [solutions[0][row * 9:row * 9 + 9] for row in range(9)]
+
+
+def remove_clues(grid, rng, symmetry='none'):
+    """
+    Remove the values of grid, a group of cells of SYMMETRY_CELLS[symmetry] at a time in random order,
+    keeping only the removals after which grid still has a single solution.
+    """
+    groups = list(SYMMETRY_CELLS[symmetry])
+    rng.shuffle(groups)
+    for group in groups:
+        values = [grid[index // 9][index % 9] for index in group]
+        for index in group:
+            grid[index // 9][index % 9] = None
+        if count_solutions(grid) != 1:
+            for index, value in zip(group, values):
+                grid[index // 9][index % 9] = value
+
+
+def generate(seed, index, symmetry='none', sudoku=None):
+    """
+    The Rating (see SudokuRating) of puzzle number index of seed, named f'{seed}:{index}'.
+    sudoku, when given, is the RatingSudoku reused for the rating.
+    """
+    rng = random.Random(f'{seed}:{index}')
+    grid = get_full_grid(rng)
+    remove_clues(grid, rng, symmetry)
+    return SudokuRating.rate(grid, f'{seed}:{index}', sudoku)
+
+
+# The board of a pool worker, reused for all the puzzles the worker rates
+worker_sudoku = None
+
+
+def generate_chunk(seed, indexes, symmetry):
+    global worker_sudoku
+    if worker_sudoku is None:
+        worker_sudoku = SudokuRating.RatingSudoku()
+    return [generate(seed, index, symmetry, worker_sudoku) for index in indexes]
+
+
+def generate_all(seed, symmetry='none', workers=1, chunk_size=4):
+    """
+    Yield the Rating of puzzles number 0, 1, 2... of seed, without end, generating chunk_size puzzles per
+    task on workers processes (0 for one per core, 1 for this process).
+    Only a few chunks per worker are generated ahead.
+    """
+    chunks = (range(start, start + chunk_size) for start in itertools.count(0, chunk_size))
+    if workers == 1:
+        sudoku = SudokuRating.RatingSudoku()
+        for index in itertools.count():
+            yield generate(seed, index, symmetry, sudoku)
+        return
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(workers) as executor:
+        pending = collections.deque(executor.submit(generate_chunk, seed, chunk, symmetry)
+                                    for chunk in itertools.islice(chunks, workers * 2))
+        while pending:
+            yield from pending.popleft().result()
+            pending.append(executor.submit(generate_chunk, seed, next(chunks), symmetry))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate sudoku puzzles at a target difficulty.')
+    parser.add_argument('-n', '--count', type=int, default=10, help='puzzles to write')
+    parser.add_argument('-l', '--levels', type=int, nargs='+', choices=range(1, 5), default=[1, 2, 3, 4],
+                        help='target algo levels: 1 singles, 2, 3 lssfc, 4 search. Default: all')
+    parser.add_argument('-s', '--seed', default=0, help='seed of the puzzles. Default: 0')
+    parser.add_argument('-y', '--symmetry', choices=SYMMETRY_CELLS, default='none', help='symmetry of the clues')
+    parser.add_argument('-o', '--output', help='puzzles file, default: stdout')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of processes, 0 for one per core. Default: 1, generate in this process')
+    parser.add_argument('-c', '--chunk-size', type=int, default=4, help='puzzles generated per task')
+    args = parser.parse_args(argv)
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    levels = collections.Counter()
+    count = 0
+    start = time.perf_counter()
+    try:
+        for rating in generate_all(args.seed, args.symmetry, args.workers, args.chunk_size):
+            level = SudokuRating.get_level(rating)
+            levels[level] += 1
+            if level in args.levels:
+                output.write(f'{rating} {rating.name}\n')
+                output.flush()
+                count += 1
+                if count >= args.count:
+                    break
+    finally:
+        if args.output:
+            output.close()
+
+    minutes = (time.perf_counter() - start) / 60
+    for level in range(1, 5):
+        print(f'level {level}: {levels[level]} ,puzzles per minute: {levels[level] / minutes if minutes else 0:.1f}' +
+              ('' if level in args.levels else ' (not written)'), file=sys.stderr)
+    print(f'Puzzles: {sum(levels.values())} ,written: {count} ,seconds: {minutes * 60:.3f}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
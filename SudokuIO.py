@@ -0,0 +1,138 @@
+import mmap
+import os
+import re
+import sys
+
+# Read and write puzzles as 81 characters lines, row by row, '.' or '0' for an empty cell.
+# A line may hold other fields around the puzzle, e.g. a rating or a solution, separated by spaces, tabs,
+# commas or semicolons: the puzzle is its first field of 81 puzzle characters, the other fields are kept
+# as strings. Lines without a puzzle (e.g. headers) and comment lines ('#') are skipped.
+# The lines are read one at a time, through a memory map for the files of MMAP_MIN_SIZE bytes or more,
+# so reading a corpus of any size keeps memory flat. Parsing a line builds its grid only, no board.
+
+EMPTY_CELL_CHARS = '.0'
+PUZZLE_CHARS = b'.0123456789'
+SEPARATORS = re.compile(rb'[\s,;]+')
+MMAP_MIN_SIZE = 1 << 24
+MMAP_RELEASE_SIZE = 1 << 24  # The pages of a memory map already read are released every MMAP_RELEASE_SIZE bytes
+CHAR_VALUES = {char: None if char in EMPTY_CELL_CHARS else int(char) for char in '.0123456789'}
+
+
+def line_to_grid(line):
+    line = line.strip()
+    if len(line) != 81:
+        raise ValueError(f"Found {len(line)} characters instead of 81 expected")
+    try:
+        values = [CHAR_VALUES[char] for char in line]
+    except KeyError as error:
+        raise ValueError(f"Found {error} instead of a value or '.'") from None
+    return [values[start:start + 9] for start in range(0, 81, 9)]
+
+
+def grid_to_line(grid):
+    return ''.join('.' if value is None else str(value) for row in grid for value in row)
+
+
+def is_puzzle(field):
+    return len(field) == 81 and not field.translate(None, PUZZLE_CHARS)
+
+
+def parse_line(raw_line):
+    """
+    The (puzzle line, list of the other fields) of a line of bytes, or None when it holds no puzzle
+    or is a comment (starts with '#').
+    """
+    if raw_line.startswith(b'#'):
+        return None
+    # Most lines start with the puzzle
+    if is_puzzle(raw_line[:81]) and (len(raw_line) == 81 or raw_line[81:82].isspace() or raw_line[81:82] in b',;'):
+        puzzle = raw_line[:81]
+        fields = SEPARATORS.split(raw_line[82:].strip()) if len(raw_line) > 82 else []
+    else:
+        fields = SEPARATORS.split(raw_line.strip())
+        index = next((index for index, field in enumerate(fields) if is_puzzle(field)), None)
+        if index is None:
+            return None
+        puzzle = fields.pop(index)
+    return puzzle.decode('ascii'), [field.decode() for field in fields if field]
+
+
+def read_raw_lines(file_name, use_mmap=None):
+    """
+    Yield the lines of file_name as bytes, through a memory map when use_mmap, or by default when the
+    file has MMAP_MIN_SIZE bytes or more.
+    """
+    with open(file_name, 'rb') as lines_file:
+        if use_mmap is None:
+            use_mmap = os.fstat(lines_file.fileno()).st_size >= MMAP_MIN_SIZE
+        if not use_mmap or os.fstat(lines_file.fileno()).st_size == 0:
+            yield from lines_file
+            return
+        with mmap.mmap(lines_file.fileno(), 0, access=mmap.ACCESS_READ) as lines_map:
+            # The pages already read are released from time to time, so that they do not pile up in memory.
+            # madvise is not there on Windows.
+            released = 0
+            can_release = hasattr(mmap, 'MADV_DONTNEED')
+            for raw_line in iter(lines_map.readline, b''):
+                yield raw_line
+                position = lines_map.tell()
+                if can_release and position - released >= MMAP_RELEASE_SIZE:
+                    end = position - position % mmap.PAGESIZE
+                    lines_map.madvise(mmap.MADV_DONTNEED, released, end - released)
+                    released = end
+
+
+def read_lines(file_name, use_mmap=None):
+    """
+    Yield (line number, puzzle line, list of the other fields) for every puzzle of file_name,
+    see the comment at the top of this file.
+    """
+    for line_number, raw_line in enumerate(read_raw_lines(file_name, use_mmap), 1):
+        parsed = parse_line(raw_line)
+        if parsed is not None:
+            yield (line_number,) + parsed
+
+
+def read_puzzles(file_name, use_mmap=None):
+    """
+    Yield (name, grid) for every puzzle of file_name, the name being f'{file_name}:{line number}'.
+    """
+    for line_number, line, _ in read_lines(file_name, use_mmap):
+        yield f'{file_name}:{line_number}', line_to_grid(line)
+
+
+class LineWriter:
+    """
+    A writer of lines to a file (default: stdout) that joins them and writes buffer_lines at a time.
+    """
+    def __init__(self, file_name=None, buffer_lines=4096):
+        self.output = sys.stdout if file_name is None else open(file_name, 'w')
+        self.buffer_lines = buffer_lines
+        self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, text):
+        self.buffer.append(text)
+        if len(self.buffer) >= self.buffer_lines:
+            self.flush()
+
+    def write_line(self, *fields):
+        """
+        Write a line of fields separated by spaces. A grid (9 lists of 9 values) field is written as its line.
+        """
+        self.write(' '.join(grid_to_line(field) if isinstance(field, list) else str(field) for field in fields) + '\n')
+
+    def flush(self):
+        self.output.write(''.join(self.buffer))
+        self.output.flush()
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        if self.output is not sys.stdout:
+            self.output.close()
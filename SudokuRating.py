@@ -0,0 +1,258 @@
+import argparse
+import collections
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import SudokuBatch
+import SudokuIO
+import SudokuVector
+from Sudoku import Sudoku
+
+# Rate the difficulty of puzzles from 0 (easiest) to 100, without a display, e.g.:
+#   python SudokuRating.py puzzles.txt -o ratings.txt
+# Each output line is the score and the puzzle. A histogram of the scores, by tens, is printed to stderr.
+# The puzzles are read as SudokuBatch reads them. Their singles are first set all at once with
+# SudokuVector.propagate, chunk by chunk; only the puzzles that need more are then solved step by step.
+#
+# The score depends on the hardest algo level the puzzle needs:
+#   0-30   singles only: one point per round of singles, plus up to 10 for the share of hidden singles.
+#   31-74  algo level 2: the score of the hardest technique used (TECHNIQUE_SCORES), plus up to 4 for
+#          the number of times techniques removed values.
+#   75-94  algo level 3: 75, plus up to 19 for its difficulty: 2 per algo level 3 step after the first, plus
+#          the longest lssfc above the shortest (2). The points tend to 19 as the difficulty grows, half of
+#          them at LEVEL3_HALF_DIFFICULTY, so the band is filled without clipping the hardest puzzles.
+#   95-100 search (algo level 4): 95, plus 1 per search step after the first.
+# Puzzles that can not be solved get no score.
+
+TECHNIQUE_SCORES = {
+    'pointing': 35,
+    'box/line reduction': 35,
+    'naked subset of 2': 40,
+    'hidden subset of 2': 45,
+    'naked subset of 3': 50,
+    'hidden subset of 3': 55,
+    'x-wing': 60,
+    'naked subset of 4': 60,
+    'hidden subset of 4': 65,
+    'fish of 3': 70,
+}
+LEVEL3_HALF_DIFFICULTY = 10  # The algo level 3 difficulty (see above) that gets half of the 19 points
+
+
+class Rating:
+    def __init__(self, name, grid):
+        self.name = name
+        self.grid = grid  # The puzzle, 9 lists of 9 values, None for an empty cell
+        self.solved = False
+        self.rounds = 0  # Rounds of singles set at once by SudokuVector.propagate
+        self.naked_singles = 0
+        self.hidden_singles = 0
+        self.techniques = collections.Counter()  # Algo level 2 technique: times it removed values
+        self.level3_steps = 0
+        self.max_lssfc = 0  # The longest lssfc of the cells solved by algo level 3
+        self.level4_steps = 0
+        self.score = None
+
+    def __str__(self):
+        return f'{"-" if self.score is None else self.score} {SudokuIO.grid_to_line(self.grid)}'
+
+
+class RatingSudoku(Sudoku):
+    """
+    A Sudoku board that records the techniques it solves with, for rate_board. The recording is
+    here only, so Sudoku is not slowed down by it.
+    """
+    def __init__(self, verbose=0):
+        super().__init__(verbose)
+        self.last_single = None  # 'naked' or 'hidden': the kind of the last single found
+        self.techniques = collections.Counter()
+
+    def reset(self):
+        super().reset()
+        self.last_single = None
+        self.techniques = collections.Counter()
+
+    def get_naked_single(self):
+        cell = super().get_naked_single()
+        if cell is not None:
+            self.last_single = 'naked'
+        return cell
+
+    def get_hidden_single(self, units):
+        hidden_single = super().get_hidden_single(units)
+        if hidden_single is not None:
+            self.last_single = 'hidden'
+        return hidden_single
+
+    def remove_values(self, indexes, values_mask, technique):
+        removed = super().remove_values(indexes, values_mask, technique)
+        if removed:
+            self.techniques[technique] += 1
+        return removed
+
+
+def rate_board(rating, grid, sudoku):
+    """
+    Solve grid step by step on sudoku (a RatingSudoku), the same way SudokuBatch.solve does,
+    adding to rating what each step needed.
+    """
+    sudoku.reset()
+    sudoku.load_puzzle(grid)
+    level3_failed = False
+    while sudoku.solve_able and not sudoku.solved:
+        sudoku.last_single = None
+        if sudoku.solve_next_cell() is not None:
+            if sudoku.last_single == 'naked':
+                rating.naked_singles += 1
+            else:
+                rating.hidden_singles += 1
+            continue
+        if not level3_failed:
+            solved_step = sudoku.solved_step
+            sudoku.apply_algo_level3()
+            if sudoku.solved_step != solved_step:
+                rating.level3_steps += 1
+                rating.max_lssfc = max(rating.max_lssfc, sudoku.steps[-1][1].get_lssfc()[0])
+                continue
+            level3_failed = True
+        if sudoku.apply_algo_level4() is None:
+            break
+        rating.level4_steps += 1
+    rating.techniques.update(sudoku.techniques)
+    rating.solved = sudoku.solved
+
+
+def get_score(rating):
+    """
+    The 0-100 score of rating, see the comment at the top of this file. None when not solved.
+    """
+    if not rating.solved:
+        return None
+    if rating.level4_steps:
+        return min(100, 95 + rating.level4_steps - 1)
+    if rating.level3_steps:
+        difficulty = 2 * (rating.level3_steps - 1) + max(0, rating.max_lssfc - 2)
+        return 75 + round(19 * (1 - 0.5 ** (difficulty / LEVEL3_HALF_DIFFICULTY)))
+    if rating.techniques:
+        hardest = max(TECHNIQUE_SCORES[technique] for technique in rating.techniques)
+        return hardest + min(4, sum(rating.techniques.values()) - 1)
+    singles = rating.naked_singles + rating.hidden_singles
+    hidden_share = rating.hidden_singles / singles if singles else 0
+    return min(30, rating.rounds + round(10 * hidden_share))
+
+
+def get_level(rating):
+    """
+    The hardest algo level rating needed: 1 for singles only, 2, 3 or 4 (search). None when not solved.
+    """
+    if not rating.solved:
+        return None
+    if rating.level4_steps:
+        return 4
+    if rating.level3_steps:
+        return 3
+    return 2 if rating.techniques else 1
+
+
+def rate_batch(puzzles, sudoku=None):
+    """
+    Rate a list of (name, grid): set the singles of all the puzzles at once, then rate step by step
+    (see rate_board) the puzzles that got stuck, from where they got stuck. A puzzle found not
+    solvable by the singles is rated step by step from its grid, as solving it would be.
+    sudoku, when given, is the RatingSudoku reused for the step by step rating.
+    Return the list of Rating.
+    """
+    if sudoku is None:
+        sudoku = RatingSudoku()
+    values, candidates = SudokuVector.grids_to_arrays([grid for _, grid in puzzles])
+    counts = np.zeros((len(puzzles), 3), dtype=np.int64)
+    new_values, _, solved, contradicted = SudokuVector.propagate(values, candidates, counts)
+
+    ratings = []
+    for (name, grid), board_values, board_counts, board_solved, board_contradicted in \
+            zip(puzzles, new_values, counts.tolist(), solved.tolist(), contradicted.tolist()):
+        rating = Rating(name, grid)
+        if board_contradicted:
+            rate_board(rating, grid, sudoku)
+        else:
+            rating.rounds, rating.naked_singles, rating.hidden_singles = board_counts
+            if board_solved:
+                rating.solved = True
+            else:
+                rate_board(rating, SudokuVector.arrays_to_grid(board_values), sudoku)
+        rating.score = get_score(rating)
+        ratings.append(rating)
+    return ratings
+
+
+def rate(grid, name=None, sudoku=None):
+    """
+    The Rating of a single grid, see rate_batch.
+    """
+    return rate_batch([(name, grid)], sudoku)[0]
+
+
+# The board of a pool worker, reused for all the puzzles the worker rates
+worker_sudoku = None
+
+
+def rate_chunk(chunk):
+    global worker_sudoku
+    if worker_sudoku is None:
+        worker_sudoku = RatingSudoku()
+    return rate_batch(chunk, worker_sudoku)
+
+
+def rate_all(puzzles, chunk_size=256, workers=1):
+    """
+    Yield the Rating of every (name, grid) of puzzles, in order, rating chunk_size puzzles at a time
+    on workers processes (0 for one per core).
+    """
+    chunks = SudokuBatch.get_chunks(puzzles, chunk_size)
+    if workers == 1:
+        sudoku = RatingSudoku()
+        for chunk in chunks:
+            yield from rate_batch(chunk, sudoku)
+        return
+    with ProcessPoolExecutor(workers or os.cpu_count()) as executor:
+        for ratings in executor.map(rate_chunk, chunks):
+            yield from ratings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rate the difficulty of sudoku puzzles, 0-100.')
+    parser.add_argument('puzzles_file', nargs='?',
+                        help='one 81 characters puzzle per line, or a python file of grids. ' +
+                             'Default: the puzzles of SudokuPuzzles.py')
+    parser.add_argument('-o', '--output', help='ratings file, default: stdout')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of processes, 0 for one per core. Default: 1, rate in this process')
+    parser.add_argument('-c', '--chunk-size', type=int, default=256, help='puzzles rated at once')
+    args = parser.parse_args(argv)
+
+    puzzles = SudokuBatch.read_puzzles(args.puzzles_file) if args.puzzles_file else \
+        SudokuBatch.read_sudoku_puzzles()
+    histogram = collections.Counter()
+    count = 0
+    start = time.perf_counter()
+    with SudokuIO.LineWriter(args.output) as output:
+        for rating in rate_all(puzzles, args.chunk_size, args.workers):
+            count += 1
+            histogram[None if rating.score is None else min(rating.score // 10, 9)] += 1
+            output.write(f'{rating}\n')
+
+    seconds = time.perf_counter() - start
+    for bucket in range(10):
+        print(f'{bucket * 10:3}-{bucket * 10 + 9 if bucket < 9 else 100:3}: {histogram[bucket]}', file=sys.stderr)
+    if histogram[None]:
+        print(f'not solvable: {histogram[None]}', file=sys.stderr)
+    print(f'Puzzles: {count} ,seconds: {seconds:.3f} ,' +
+          f'puzzles per second: {count / seconds if seconds else 0:.1f}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
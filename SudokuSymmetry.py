@@ -0,0 +1,393 @@
+import itertools
+
+# Sudoku symmetries: the transforms of a grid that keep it a sudoku, and the canonical form of a grid.
+# A transform permutes the bands (groups of 3 rows) and the rows within each band, the stacks (groups
+# of 3 cols) and the cols within each stack, may transpose the grid first, and relabels the values.
+# The canonical form of a grid is the smallest of all its transforms, compared as 81 values row by
+# row, 0 for an empty cell, values relabelled in order of first appearance. Two grids have the same
+# canonical form exactly when one is a transform of the other.
+#
+# The canonical form is built row by row, keeping only the partial transforms that give the smallest
+# rows so far. The cols are not chosen one by one: a partial transform holds the cols in groups whose
+# order is still open (see get_row_key), which the next rows split.
+# When the first row has DENSE_FIRST_ROW values or more, the groups would split into every order of its
+# values, each relabelling it the same. Instead, the labels are fixed from the positions of the first row
+# (the values are relabelled in order, so the value at a position gets the label of the position), and
+# the cols are placed position by position by the second row, see place_second_row.
+# A puzzle takes about half a millisecond, a grid with a few empty cells as much, a solved grid about 8.
+
+UNSET = 10  # The key of a value not relabelled yet: above every label, see get_cell_keys
+ALL_COLS = ((((0, 1, 2),), ((3, 4, 5),), ((6, 7, 8),)),)  # One group of 3 stacks, each of one group of 3 cols
+BANDS = ((0, 1, 2), (3, 4, 5), (6, 7, 8))
+DENSE_FIRST_ROW = 6  # Values in the first row from which the cols are placed by place_second_row
+
+
+class Transform:
+    def __init__(self, transposed, rows, cols, labels):
+        self.transposed = transposed
+        self.rows = rows  # The row of the grid (transposed when transposed) that goes to each row
+        self.cols = cols  # The col of the grid (transposed when transposed) that goes to each col
+        self.labels = labels  # The new value of each value, labels[value], 0 stays 0
+
+    def apply(self, grid):
+        """
+        The grid (9 lists of 9 values, None for an empty cell) transformed.
+        """
+        if self.transposed:
+            grid = [list(col) for col in zip(*grid)]
+        return [[None if grid[row][col] is None else self.labels[grid[row][col]] for col in self.cols]
+                for row in self.rows]
+
+    def invert(self, grid):
+        """
+        The grid the transform of which is grid: the inverse of apply.
+        """
+        values = [0] * 10
+        for value, label in enumerate(self.labels):
+            values[label] = value
+        original = [[None] * 9 for _ in range(9)]
+        for grid_row, row in zip(grid, self.rows):
+            for value, col in zip(grid_row, self.cols):
+                original[row][col] = None if value is None else values[value]
+        if self.transposed:
+            original = [list(col) for col in zip(*original)]
+        return original
+
+    def invert_cell(self, row, col, value):
+        """
+        The (row, col, value) of the grid that goes to (row, col) with value: the inverse of apply, for
+        a single cell.
+        """
+        row, col = self.rows[row], self.cols[col]
+        if self.transposed:
+            row, col = col, row
+        return row, col, self.labels.index(value)
+
+
+def get_cell_keys(row_values, labels):
+    """
+    The key of each cell of a row: 0 for an empty cell, the label of its value, or UNSET when the
+    value is not relabelled yet. The labels of the UNSET values follow the order of their cols, so
+    two orders of the cols with the same keys give the same relabelled row.
+    """
+    return [labels[value] or UNSET if value else 0 for value in row_values]
+
+
+def get_row_key(stacks, keys):
+    """
+    The smallest row key that a row with the cell keys (see get_cell_keys) can get with the cols in
+    stacks: its cell keys, with the cols in order.
+    stacks is a tuple of groups of stacks, each stack a tuple of groups of cols. The groups are in
+    order, the stacks within a group and the cols within a group of cols can be in any order.
+    """
+    row_key = []
+    for stack_group in stacks:
+        if len(stack_group) == 1:
+            if len(stack_group[0]) == 3:
+                row_key += [keys[col] for col, in stack_group[0]]
+                continue
+            for col_group in stack_group[0]:
+                if len(col_group) == 1:
+                    row_key.append(keys[col_group[0]])
+                else:
+                    row_key += sorted([keys[col] for col in col_group])
+            continue
+        stack_keys = []
+        for stack in stack_group:
+            stack_key = []
+            for col_group in stack:
+                stack_key += sorted([keys[col] for col in col_group])
+            stack_keys.append(stack_key)
+        for stack_key in sorted(stack_keys):
+            row_key += stack_key
+    return row_key
+
+
+def split_group(items, item_keys):
+    """
+    Split a group of items (in any order) by their keys, in order of the keys. Items with the same
+    key stay in a group, except for a key with an UNSET value: the order of these items sets the
+    labels, so every order is an alternative.
+    Return the alternatives, each a list of groups.
+    """
+    if len(items) == 1:
+        return [[tuple(items)]]
+    choices = []
+    for item_key, run in itertools.groupby(sorted(zip(item_keys, items)), key=lambda key_item: key_item[0]):
+        run_items = tuple(item for _, item in run)
+        if len(run_items) > 1 and UNSET in (item_key if isinstance(item_key, tuple) else (item_key,)):
+            choices.append([[(item,) for item in order] for order in itertools.permutations(run_items)])
+        else:
+            choices.append([[run_items]])
+    if all(len(choice) == 1 for choice in choices):
+        return [[group for choice in choices for group in choice[0]]]
+    return [[group for groups in choice for group in groups] for choice in itertools.product(*choices)]
+
+
+def refine_cols(stacks, keys):
+    """
+    Split the groups of stacks by the cell keys of a row (see get_row_key).
+    Return the alternatives (see split_group), each a new stacks.
+    """
+    if len(stacks) == 3 and all(len(stack) == 3 for stack, in stacks):
+        return [stacks]
+    stack_groups_choices = []
+    for stack_group in stacks:
+        # Per stack, the alternative orders of its cols, all with the same key
+        stack_choices = []
+        stack_keys = []
+        for stack in stack_group:
+            if len(stack) == 3:
+                # Its cols are in order already
+                stack_choices.append((stack,))
+                stack_keys.append(tuple(keys[col] for col, in stack))
+                continue
+            col_groups_choices = [split_group(col_group, [keys[col] for col in col_group]) for col_group in stack]
+            stack_choices.append([tuple(group for groups in choice for group in groups)
+                                  for choice in itertools.product(*col_groups_choices)])
+            stack_keys.append(tuple(key for col_group in stack for key in sorted([keys[col] for col in col_group])))
+        if len(stack_group) == 1:
+            stack_groups_choices.append([((new_stack,),) for new_stack in stack_choices[0]])
+            continue
+        group_choices = []
+        for new_stacks in itertools.product(*stack_choices):
+            for groups in split_group(range(len(stack_group)), stack_keys):
+                group_choices.append(tuple(tuple(new_stacks[index] for index in group) for group in groups))
+        stack_groups_choices.append(group_choices)
+    return [tuple(group for groups in choice for group in groups)
+            for choice in itertools.product(*stack_groups_choices)]
+
+
+def set_labels(stacks, row_values, labels, next_label):
+    """
+    Relabel the values of row_values not relabelled yet, in the order of their cols in stacks.
+    Return the new (labels, next label).
+    """
+    labels = list(labels)
+    for stack_group in stacks:
+        for stack in stack_group:
+            for col_group in stack:
+                for col in col_group:
+                    value = row_values[col]
+                    if value and not labels[value]:
+                        labels[value] = next_label
+                        next_label += 1
+    return tuple(labels), next_label
+
+
+def get_next_rows(bands_left, band_rows_left):
+    """
+    The (row, bands left, rows of the band left) of every row that can go next.
+    """
+    if band_rows_left:
+        return tuple((row, bands_left, tuple(band_row for band_row in band_rows_left if band_row != row))
+                     for row in band_rows_left)
+    return tuple((row, tuple(other_band for other_band in bands_left if other_band != band),
+                  tuple(band_row for band_row in BANDS[band] if band_row != row))
+                 for band in bands_left for row in BANDS[band])
+
+
+# (bands left, rows of the band left): get_next_rows, for every rows of the band left of every bands left
+NEXT_ROWS = {(bands_left, band_rows_left): get_next_rows(bands_left, band_rows_left)
+             for size in range(4) for bands_left in itertools.permutations(range(3), size)
+             for band_rows_left in [()] + [rows for band in range(3) if band not in bands_left for rows_size in (1, 2)
+                                           for rows in itertools.combinations(BANDS[band], rows_size)]}
+
+
+def place_second_row(first_values, second_values, bound=None):
+    """
+    For a first row with many values: the orders of the cols that give the first row its smallest key,
+    then the second row its smallest key (see get_row_key). The first row key only sets which positions
+    hold its values (the stacks with fewer values first, the empty cells first in each stack), and the
+    label of each of these positions. The cols are placed by position: a value of the second row that is in
+    the first row gets the label of the position of its col there, so a col not placed yet is placed at
+    the first position that fits it, the smallest label. The partial orders that give a larger key at a
+    position are dropped, and so are all of them once the key gets larger than bound, the smallest key so far.
+    Return (the key of the second row, the list of (cols of each position, labels), next label), None when
+    the key is larger than bound.
+    """
+    counts = [3 - first_values[col:col + 3].count(0) for col in (0, 3, 6)]
+    slot_counts = sorted(counts)
+    value_positions = [position % 3 >= 3 - slot_counts[position // 3] for position in range(9)]
+    position_labels = [sum(value_positions[:position + 1]) if value_positions[position] else 0 for position in range(9)]
+    value_cols = {value: col for col, value in enumerate(first_values) if value}
+
+    # A state is (the col of each position, -1 for none yet, the stack of each slot of 3 positions)
+    states = {((-1,) * 9, (-1,) * 3)}
+    key = []
+    for position in range(9):
+        slot = position // 3
+        best_key = UNSET if bound is None else bound[position]
+        next_states = []
+        for cols, slot_stacks in states:
+            if cols[position] >= 0:
+                choices = (cols[position],)
+            else:
+                stacks = (slot_stacks[slot],) if slot_stacks[slot] >= 0 else \
+                    [stack for stack in range(3) if counts[stack] == slot_counts[slot] and stack not in slot_stacks]
+                choices = [col for stack in stacks for col in range(stack * 3, stack * 3 + 3)
+                           if col not in cols and bool(first_values[col]) == value_positions[position]]
+            for col in choices:
+                value = second_values[col]
+                value_col = value_cols.get(value, -1)
+                place = -1
+                if not value:
+                    cell_key = 0
+                elif value_col < 0:
+                    cell_key = UNSET
+                elif value_col == col:
+                    cell_key = position_labels[position]
+                elif value_col in cols:
+                    cell_key = position_labels[cols.index(value_col)]
+                else:
+                    # The first free position of a value in the slot of its stack, or of a slot it can go to
+                    stack = value_col // 3
+                    stacks_after = slot_stacks[:slot] + (col // 3,) + slot_stacks[slot + 1:]
+                    for place_slot in range(slot, 3):
+                        slot_stack = stacks_after[place_slot]
+                        if slot_stack == stack or slot_stack < 0 and stack not in stacks_after and \
+                                counts[stack] == slot_counts[place_slot]:
+                            place = next((place for place in range(max(place_slot * 3, position + 1),
+                                                                   place_slot * 3 + 3)
+                                          if cols[place] < 0 and value_positions[place]), -1)
+                            if place >= 0 or slot_stack == stack:
+                                break
+                    if place < 0:
+                        continue
+                    cell_key = position_labels[place]
+                if cell_key > best_key:
+                    continue
+                if cell_key < best_key:
+                    best_key = cell_key
+                    next_states = []
+                new_cols = list(cols)
+                new_cols[position] = col
+                new_slot_stacks = list(slot_stacks)
+                new_slot_stacks[slot] = col // 3
+                if place >= 0:
+                    new_cols[place] = value_col
+                    new_slot_stacks[place // 3] = value_col // 3
+                next_states.append((tuple(new_cols), tuple(new_slot_stacks)))
+        if not next_states:
+            return None
+        if bound is not None and best_key < bound[position]:
+            bound = None
+        states = set(next_states)
+        key.append(best_key)
+
+    orders = []
+    for cols, _ in states:
+        labels = [0] * 10
+        for col, label in zip(cols, position_labels):
+            if label:
+                labels[first_values[col]] = label
+        orders.append((cols, tuple(labels)))
+    return key, orders, sum(counts) + 1
+
+
+def refine_states(best, values, transposed_values):
+    """
+    The states (see get_canonical_form) that best, the states with their next row added, become:
+    each with its cols refined by its new row and the new values of the row relabelled.
+    States that only differ by the order of their rows so far have the same next rows: only the first
+    is kept.
+    """
+    states = {}
+    for transposed, rows, bands_left, band_rows_left, stacks, labels, next_label in best:
+        row_values = (transposed_values if transposed else values)[rows[-1]]
+        for new_stacks in refine_cols(stacks, get_cell_keys(row_values, labels)):
+            new_labels, new_next_label = set_labels(new_stacks, row_values, labels, next_label)
+            states.setdefault((transposed, bands_left, band_rows_left, new_stacks, new_labels),
+                              (transposed, rows, bands_left, band_rows_left, new_stacks, new_labels, new_next_label))
+    return states.values()
+
+
+def place_second_rows(best, values, transposed_values):
+    """
+    The states (see get_canonical_form) with the smallest second row, from best, the states of the first
+    rows with many values, see place_second_row.
+    """
+    second_best = []
+    best_key = None
+    for transposed, (row,), bands_left, band_rows_left, _, _, _ in best:
+        grid_values = transposed_values if transposed else values
+        for second_row, next_bands_left, next_band_rows_left in NEXT_ROWS[bands_left, band_rows_left]:
+            placed = place_second_row(grid_values[row], grid_values[second_row], best_key)
+            if placed is None:
+                continue
+            key, orders, next_label = placed
+            if best_key is None or key < best_key:
+                best_key = key
+                second_best = []
+            if key == best_key:
+                second_best += [(transposed, (row, second_row), next_bands_left, next_band_rows_left,
+                                 tuple(((tuple((col,) for col in cols[stack:stack + 3]),) for stack in (0, 3, 6))),
+                                 labels, next_label)
+                                for cols, labels in orders]
+    return second_best
+
+
+def check_units(values, transposed_values):
+    """
+    Raise ValueError when a row, col or square of values (9 tuples of 9 values, 0 for an empty cell)
+    repeats a value.
+    """
+    squares = [[values[row][col] for row in band for col in stack] for band in BANDS for stack in BANDS]
+    for unit_name, units in (('row', values), ('col', transposed_values), ('square', squares)):
+        for index, unit in enumerate(units):
+            unit_values = [value for value in unit if value]
+            if len(set(unit_values)) != len(unit_values):
+                raise ValueError(f'The grid repeats a value in {unit_name} {index + 1}')
+
+
+def get_canonical_form(grid):
+    """
+    The canonical form of grid (9 lists of 9 values, None for an empty cell), see the comment at the
+    top of this file, as an 81 characters line ('.' for an empty cell), with a Transform from grid
+    to the canonical form. Raises ValueError when grid repeats a value in a row, col or square: the
+    search relies on each value being once in a row.
+    """
+    values = tuple(tuple(value or 0 for value in row) for row in grid)
+    if not any(map(any, values)):
+        # Every transform gives the empty grid
+        return '.' * 81, Transform(False, list(range(9)), list(range(9)), list(range(10)))
+    transposed_values = tuple(zip(*values))
+    check_units(values, transposed_values)
+
+    # A state is a partial transform: (transposed, rows so far, bands left, rows of the band left,
+    # stacks, labels, next label), best are the states with the smallest rows so far.
+    # The key of the first row (see get_row_key) only depends on the number of values in each of its
+    # stacks, as no value is relabelled yet and the stacks can be in any order: the fewer the smaller.
+    first_rows = [(sorted(3 - row_values[col:col + 3].count(0) for col in (0, 3, 6)), transposed, row)
+                  for transposed, grid_values in ((False, values), (True, transposed_values))
+                  for row, row_values in enumerate(grid_values)]
+    first_key = min(first_rows)[0]
+    best = [(transposed, (row,), tuple(band for band in range(3) if band != row // 3),
+             tuple(band_row for band_row in BANDS[row // 3] if band_row != row), ALL_COLS, (0,) * 10, 1)
+            for key, transposed, row in first_rows if key == first_key]
+    if sum(first_key) >= DENSE_FIRST_ROW:
+        best = place_second_rows(best, values, transposed_values)
+    for _ in range(len(best[0][1]) - 1, 8):
+        states = refine_states(best, values, transposed_values)
+        best = [(transposed, rows + (row,), next_bands_left, next_band_rows_left, stacks, labels, next_label)
+                for transposed, rows, bands_left, band_rows_left, stacks, labels, next_label in states
+                for row, next_bands_left, next_band_rows_left in NEXT_ROWS[bands_left, band_rows_left]]
+        if len(best) == 1:
+            # The last row of a band, with a single state: nothing to compare
+            continue
+        keys = [get_row_key(stacks, get_cell_keys((transposed_values if transposed else values)[rows[-1]], labels))
+                for transposed, rows, _, _, stacks, labels, _ in best]
+        best_key = min(keys)
+        best = [state for state, key in zip(best, keys) if key == best_key]
+
+    # All the states left give the canonical form, any of them is the transform
+    transposed, rows, _, _, stacks, labels, next_label = min(refine_states(best, values, transposed_values))
+    cols = [col for stack_group in stacks for stack in stack_group for col_group in stack for col in col_group]
+    labels = list(labels)
+    for value in range(1, 10):
+        if not labels[value]:
+            labels[value] = next_label
+            next_label += 1
+    transform = Transform(transposed, list(rows), cols, labels)
+    line = ''.join('.' if value is None else str(value) for row in transform.apply(grid) for value in row)
+    return line, transform
@@ -0,0 +1,322 @@
+import numpy as np
+
+from Sudoku import Sudoku, UNITS
+
+# Candidates engine on numpy arrays.
+# The candidates of a board are a (9, 9, 9) boolean tensor: candidates[row, col, value - 1] is True when value
+# is avail in the non solved cell (row, col). Solved cells have no candidates, their values are in a (9, 9)
+# integer array, 0 for a non solved cell.
+# The functions below also work on a stack of boards: (..., 9, 9, 9) candidates with (..., 9, 9) values.
+# Per unit results are (..., 27, 9): [unit, value - 1] for the rows, then the cols, then the squares,
+# as in Sudoku.UNITS.
+
+VALUES = np.arange(1, 10)
+UNIT_CELLS = np.array(UNITS)  # (27, 9): the flat indexes of the cells of each unit
+ROWS = slice(0, 9)
+COLS = slice(9, 18)
+SQUARES = slice(18, 27)
+MASK_CANDIDATES = ((np.arange(1 << 10)[:, None] >> VALUES) & 1).astype(bool)  # (1024, 9): the values of each mask
+MASK_SIZES = MASK_CANDIDATES.sum(axis=-1, dtype=np.int8)
+
+
+def masks_to_candidates(masks):
+    """
+    (..., 81) avail values masks (bit v set for an avail value v) to (..., 9, 9, 9) candidates.
+    """
+    masks = np.asarray(masks)
+    return ((masks[..., None] >> VALUES) & 1).astype(bool).reshape(masks.shape[:-1] + (9, 9, 9))
+
+
+def grids_to_arrays(grids):
+    """
+    Grids (each 9 lists of 9 values, None for an empty cell) to (N, 9, 9) values and (N, 9, 9, 9)
+    candidates, the candidates of each empty cell being all the values not set in its row, col and square.
+    """
+    values = np.array([[[value or 0 for value in row] for row in grid] for grid in grids], dtype=np.int8)
+    values = values.reshape(len(grids), 9, 9)
+    candidates = np.broadcast_to((values == 0)[..., None], values.shape + (9,))
+    return values, eliminate_peers(candidates, values)
+
+
+def grid_to_arrays(grid):
+    """
+    The (values, candidates) of a single grid, see grids_to_arrays.
+    """
+    values, candidates = grids_to_arrays([grid])
+    return values[0], candidates[0]
+
+
+def arrays_to_grid(values):
+    """
+    (9, 9) values to a grid, 9 lists of 9 values, None for an empty cell.
+    """
+    return [[value or None for value in row] for row in values.tolist()]
+
+
+def sudoku_to_arrays(sudoku):
+    """
+    The (values, candidates) of a Sudoku board, from its cells.
+    """
+    values = np.fromiter((cell.value or 0 for cell in sudoku.flat_cells), dtype=np.int64, count=81)
+    masks = np.fromiter((cell.available_values if cell.value is None else 0 for cell in sudoku.flat_cells),
+                        dtype=np.int64, count=81)
+    return values.reshape(9, 9), masks_to_candidates(masks)
+
+
+def add_slices(tensor, axis):
+    """
+    The uint8 sum of a boolean (or uint8) tensor over axis. For the short axes of a board,
+    adding the slices is much faster than sum().
+    """
+    slices = np.moveaxis(tensor.view(np.uint8), axis, 0)
+    total = slices[0] + slices[1]
+    for tensor_slice in slices[2:]:
+        total += tensor_slice
+    return total
+
+
+def get_unit_sums(tensor):
+    """
+    (..., 27, 9) sums of a (..., 9, 9, 9) boolean tensor over the cells of each unit.
+    """
+    shape = tensor.shape[:-3]
+    squares = add_slices(add_slices(tensor.reshape(shape + (3, 3, 3, 3, 9)), -4), -2)
+    return np.concatenate((add_slices(tensor, -2), add_slices(tensor, -3), squares.reshape(shape + (9, 9))), axis=-2)
+
+
+def get_board_unit_sums(tensor):
+    """
+    The get_unit_sums of a single board's (9, 9, 9) tensor. Gathering the cells of the units is faster
+    than adding slices for a single board, not for a stack.
+    """
+    return tensor.reshape(81, 9)[UNIT_CELLS].sum(axis=1, dtype=np.uint8)
+
+
+def get_unit_cells(unit_tensor):
+    """
+    (..., 9, 9, 9) booleans: [row, col, value - 1] is True when [unit, value - 1] of the
+    (..., 27, 9) unit_tensor is True for the row, the col or the square of the cell.
+    """
+    shape = unit_tensor.shape[:-2]
+    squares = unit_tensor[..., SQUARES, :].reshape(shape + (3, 1, 3, 1, 9))
+    squares = np.broadcast_to(squares, shape + (3, 3, 3, 3, 9)).reshape(shape + (9, 9, 9))
+    return unit_tensor[..., ROWS, None, :] | unit_tensor[..., None, COLS, :] | squares
+
+
+def values_to_tensor(values):
+    """
+    (..., 9, 9, 9) booleans: [row, col, value - 1] is True when value is set in the cell.
+    """
+    return values[..., None] == VALUES
+
+
+def get_unit_values(values):
+    """
+    (..., 27, 9) booleans: [unit, value - 1] is True when value is set in a cell of unit.
+    """
+    return get_unit_sums(values_to_tensor(values)) > 0
+
+
+def eliminate_peers(candidates, values):
+    """
+    Remove from the candidates every value that is set in a row, col or square of the cell.
+    Return the new candidates.
+    """
+    return candidates & ~get_unit_cells(get_unit_values(values))
+
+
+def get_naked_singles(candidates):
+    """
+    (..., 9, 9) booleans: True for the cells with only one candidate.
+    """
+    return add_slices(candidates, -1) == 1
+
+
+def get_hidden_singles(candidates, values):
+    """
+    (..., 27, 9) booleans: [unit, value - 1] is True when value is not set in unit, and is
+    a candidate of only one of its cells.
+    """
+    return (get_unit_sums(candidates) == 1) & ~get_unit_values(values)
+
+
+def get_contradictions(candidates, values, unit_counts=None, unit_value_counts=None):
+    """
+    (...) booleans: True for the boards where a non solved cell has no candidates, a value is set
+    twice in a unit, or a value that is not set in a unit is a candidate of none of its cells.
+    unit_counts and unit_value_counts are the get_unit_sums of the candidates and of the values,
+    when already known.
+    """
+    if unit_counts is None:
+        unit_counts = get_unit_sums(candidates)
+    if unit_value_counts is None:
+        unit_value_counts = get_unit_sums(values_to_tensor(values))
+    shape = values.shape[:-2]
+    empty_cells = (values == 0) & (add_slices(candidates, -1) == 0)
+    no_place = (unit_counts == 0) & (unit_value_counts == 0)
+    return empty_cells.reshape(shape + (81,)).any(axis=-1) | \
+        (unit_value_counts > 1).reshape(shape + (243,)).any(axis=-1) | \
+        no_place.reshape(shape + (243,)).any(axis=-1)
+
+
+def propagate(values, candidates, counts=None):
+    """
+    Set all the naked and hidden singles of a stack of boards, (N, 9, 9) values with (N, 9, 9, 9)
+    candidates, round after round until none is left. Every round works on the whole stack of
+    the boards still going: a board drops out once it is solved, stuck, or has a contradiction.
+    Return (values, candidates, solved, contradicted), the last two (N) booleans. The boards
+    neither solved nor contradicted are stuck: they need more than singles. Set singles can not
+    turn out wrong, so a stuck board has exactly the values solving step by step gets stuck on.
+    counts, when given, is an (N, 3) integer array: the rounds that set values, the naked singles
+    and the hidden singles (of cells that were not naked singles) of each board are added to it.
+    """
+    values = values.copy()
+    candidates = candidates.copy()
+    solved = np.zeros(len(values), dtype=bool)
+    contradicted = np.zeros(len(values), dtype=bool)
+    active = np.arange(len(values))
+    while len(active):
+        board_values = values[active]
+        unit_value_counts = get_unit_sums(values_to_tensor(board_values))
+        board_candidates = candidates[active] & ~get_unit_cells(unit_value_counts > 0)
+        unit_counts = get_unit_sums(board_candidates)
+        board_contradicted = get_contradictions(board_candidates, board_values, unit_counts, unit_value_counts)
+        board_solved = (board_values != 0).reshape(len(active), 81).all(axis=-1) & ~board_contradicted
+        contradicted[active] = board_contradicted
+        solved[active] = board_solved
+
+        # The naked singles, then the hidden singles of the other cells. When hidden singles disagree
+        # on a cell one of them is set, and the board gets a contradiction on the next round.
+        hidden_cells = get_unit_cells((unit_counts == 1) & (unit_value_counts == 0)) & board_candidates
+        naked_singles = get_naked_singles(board_candidates)
+        singles = np.where(naked_singles[..., None], board_candidates, hidden_cells)
+        placed = singles.any(axis=-1)
+        board_placed = placed.reshape(len(active), 81).any(axis=-1)
+        going = ~board_contradicted & ~board_solved & board_placed
+        if counts is not None:
+            counts[active, 0] += board_placed
+            counts[active, 1] += naked_singles.reshape(len(active), 81).sum(axis=-1)
+            counts[active, 2] += (placed & ~naked_singles).reshape(len(active), 81).sum(axis=-1)
+        values[active] = np.where(placed, singles.argmax(axis=-1) + 1, board_values)
+        candidates[active] = board_candidates & ~placed[..., None]
+        active = active[going]
+    return values, candidates, solved, contradicted
+
+
+def first_naked_single(candidates):
+    """
+    The first cell (by row, then col) with only one candidate: (row, col, value), or None.
+    """
+    naked_singles = get_naked_singles(candidates).ravel()
+    index = int(naked_singles.argmax())
+    if not naked_singles[index]:
+        return None
+    row, col = divmod(index, 9)
+    return row, col, int(candidates[row, col].argmax()) + 1
+
+
+def first_hidden_single(candidates, hidden_singles, units=slice(0, 27)):
+    """
+    The first hidden single (see get_hidden_singles) of units (ROWS, COLS or SQUARES), unit by
+    unit, then value by value: (row, col, value), or None.
+    """
+    hidden_singles = hidden_singles[units].ravel()
+    index = int(hidden_singles.argmax())
+    if not hidden_singles[index]:
+        return None
+    unit, value_index = divmod(index, 9)
+    unit_cells = UNIT_CELLS[units][unit]
+    cell_index = int(unit_cells[candidates.reshape(81, 9)[unit_cells, value_index].argmax()])
+    return cell_index // 9, cell_index % 9, value_index + 1
+
+
+class VectorSudoku(Sudoku):
+    """
+    A Sudoku board that finds its naked and hidden singles with the numpy engine above.
+    It solves the same steps, in the same order, as Sudoku. Experimental: it is slower than Sudoku,
+    whose scans of a single board cost less than the numpy calls.
+    The values and the avail values masks of the cells are kept in arrays, updated as the cells change (their
+    value is set or unset, or their avail values change). The candidates are built from the masks when needed.
+    """
+    UNITS_SLICES = {UNITS[ROWS]: ROWS, UNITS[COLS]: COLS, UNITS[SQUARES]: SQUARES}
+
+    def __init__(self, verbose=1):
+        self.values = np.zeros(81, dtype=np.int8)
+        self.masks = np.zeros(81, dtype=np.int64)  # The avail values mask of each non solved cell, 0 when solved
+        self.candidates = None  # Built from masks, None when a cell changed since
+        self.hidden_singles = None
+        super().__init__(verbose)
+
+    def load_arrays(self):
+        """
+        Set the arrays from all the cells, after they changed without the methods below.
+        """
+        self.values[:] = [cell.value or 0 for cell in self.flat_cells]
+        self.masks[:] = [cell.available_values if cell.value is None else 0 for cell in self.flat_cells]
+        self.candidates = None
+
+    def reset(self):
+        super().reset()
+        self.load_arrays()
+
+    def load_puzzle(self, a):
+        super().load_puzzle(a)
+        self.load_arrays()
+
+    def load_state(self, state):
+        super().load_state(state)
+        self.load_arrays()
+
+    def set_value_to_propagate(self, cell):
+        super().set_value_to_propagate(cell)
+        self.values[cell.index] = cell.value
+        self.masks[cell.index] = 0
+        self.candidates = None
+
+    def unset_value(self, cell):
+        super().unset_value(cell)
+        self.values[cell.index] = 0
+        self.masks[cell.index] = cell.available_values
+        self.candidates = None
+
+    def change_available_values(self, cell, available_values):
+        super().change_available_values(cell, available_values)
+        if cell.value is None:
+            self.masks[cell.index] = available_values
+            self.candidates = None
+
+    def propagate_values(self):
+        changed_cells = super().propagate_values()
+        if changed_cells:
+            masks = self.masks
+            for cell in changed_cells:
+                masks[cell.index] = cell.available_values
+            self.candidates = None
+        return changed_cells
+
+    def get_arrays(self):
+        """
+        The (9, 9) values and (9, 9, 9) candidates of the board.
+        """
+        if self.candidates is None:
+            self.candidates = MASK_CANDIDATES[self.masks].reshape(9, 9, 9)
+            self.hidden_singles = None
+        return self.values.reshape(9, 9), self.candidates
+
+    def get_naked_single(self):
+        naked_singles = MASK_SIZES[self.masks] == 1
+        index = int(naked_singles.argmax())
+        if not naked_singles[index]:
+            return None
+        return self.flat_cells[index]
+
+    def get_hidden_single(self, units):
+        values, candidates = self.get_arrays()
+        if self.hidden_singles is None:
+            self.hidden_singles = (get_board_unit_sums(candidates) == 1) & \
+                (get_board_unit_sums(values_to_tensor(values)) == 0)
+        hidden_single = first_hidden_single(candidates, self.hidden_singles, self.UNITS_SLICES[units])
+        if hidden_single is None:
+            return None
+        row, col, value = hidden_single
+        return self.cells[row][col], value